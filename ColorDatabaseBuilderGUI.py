@@ -4,24 +4,1894 @@ import json
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from tkinter.colorchooser import askcolor
-from queue import Queue
+from queue import Queue, Empty
 import threading
+import io
 import time
+import os
+import shutil
+import struct
+import colorsys
+import heapq
+import sys
+import tempfile
+from array import array
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from urllib.request import pathname2url
+
+# 每个字节中置位的数量，用于快速统计位图
+_POPCOUNT_TABLE = bytes(bin(i).count('1') for i in range(256))
+
+# 常用SQL登记表：所有调用方使用完全相同的文本，连接的语句缓存中每条只编译一次
+STATEMENTS = {
+    'table_exists': "SELECT name FROM sqlite_master WHERE type='table' AND name='colors'",
+    'max_rowid': "SELECT MAX(rowid) FROM colors",
+    'count': "SELECT COUNT(*) FROM colors",
+    'last_color': "SELECT r, g, b, name FROM colors ORDER BY rowid DESC LIMIT 1",
+    'all_colors': "SELECT r, g, b, name FROM colors",
+    'all_rgb': "SELECT r, g, b FROM colors",
+    'insert_color': "INSERT OR IGNORE INTO colors VALUES (?, ?, ?, ?)",
+    'replace_color': "INSERT OR REPLACE INTO colors VALUES (?, ?, ?, ?)",
+    'read_generation': "SELECT value FROM main.meta WHERE key = 'generation'",
+    'write_generation': "INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)",
+    # 补全生成的行按rowid区间登记，键为 'gap_fill:<起始rowid>'，值为结束rowid
+    'gap_fill_ranges': "SELECT CAST(substr(key, 10) AS INTEGER), value FROM meta WHERE key LIKE 'gap_fill:%'",
+    'write_gap_fill_range': "INSERT OR REPLACE INTO meta (key, value) VALUES ('gap_fill:' || ?, ?)",
+}
+
+
+class ColorPresenceBitmap:
+    """RGB立方体存在位图：2^24种颜色各占1位，共2MB，与colors表保持同步"""
+    
+    SIZE = 1 << 24
+    MAGIC = b'CDBBMAP1'
+    HEADER = struct.Struct('<8sQq')  # 魔数, 颜色数量, 保存时的MAX(rowid)
+    BLOCK = 16  # 覆盖率分析的分块边长，共16^3=4096块
+    HUE_BINS = 12
+    LIGHTNESS_BINS = 8
+    
+    def __init__(self, data=None, max_rowid: int = 0):
+        self.bits = bytearray(self.SIZE >> 3) if data is None else bytearray(data)
+        self.max_rowid = max_rowid
+        self._count = sum(self.bits.translate(_POPCOUNT_TABLE))
+    
+    def __len__(self):
+        return self._count
+    
+    def __contains__(self, rgb):
+        r, g, b = rgb
+        idx = (r << 16) | (g << 8) | b
+        return bool(self.bits[idx >> 3] & (1 << (idx & 7)))
+    
+    def add(self, r: int, g: int, b: int) -> bool:
+        """标记颜色存在，返回该颜色是否为新颜色"""
+        idx = (r << 16) | (g << 8) | b
+        mask = 1 << (idx & 7)
+        if self.bits[idx >> 3] & mask:
+            return False
+        self.bits[idx >> 3] |= mask
+        self._count += 1
+        return True
+    
+    def clear(self):
+        """清空位图"""
+        self.bits = bytearray(self.SIZE >> 3)
+        self.max_rowid = 0
+        self._count = 0
+    
+    def filter_new(self, batch: list) -> list:
+        """过滤掉已存在（或同批次中重复）的颜色，并将保留的颜色标记为存在
+        
+        与INSERT OR IGNORE的语义一致：同一颜色只保留第一次出现的记录
+        """
+        bits = self.bits
+        fresh = []
+        for row in batch:
+            idx = (row[0] << 16) | (row[1] << 8) | row[2]
+            mask = 1 << (idx & 7)
+            if not bits[idx >> 3] & mask:
+                bits[idx >> 3] |= mask
+                fresh.append(row)
+        self._count += len(fresh)
+        return fresh
+    
+    def save(self, path: str):
+        """保存位图到文件（先写临时文件再替换，避免留下半个文件）"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self._count, self.max_rowid))
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str):
+        """从文件加载位图，文件不存在或已损坏时返回None"""
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(cls.HEADER.size)
+                data = f.read()
+        except OSError:
+            return None
+        if len(header) != cls.HEADER.size or len(data) != cls.SIZE >> 3:
+            return None
+        magic, count, max_rowid = cls.HEADER.unpack(header)
+        if magic != cls.MAGIC:
+            return None
+        bitmap = cls(data, max_rowid)
+        if len(bitmap) != count:
+            return None
+        return bitmap
+    
+    @classmethod
+    def from_database(cls, conn, batch_size: int = 10000):
+        """扫描colors表重建位图"""
+        bitmap = cls()
+        bits = bitmap.bits
+        cursor = conn.execute(STATEMENTS['all_rgb'])
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for r, g, b in rows:
+                idx = (r << 16) | (g << 8) | b
+                bits[idx >> 3] |= 1 << (idx & 7)
+        bitmap._count = sum(bits.translate(_POPCOUNT_TABLE))
+        bitmap.max_rowid = conn.execute(STATEMENTS['max_rowid']).fetchone()[0] or 0
+        return bitmap
+    
+    def block_counts(self) -> list:
+        """统计每个16x16x16分块中已命名颜色的数量
+        
+        位索引为 r<<16 | g<<8 | b，因此每个 (r, g) 行占32字节，
+        每个分块在行内对应连续的2个字节
+        """
+        counts = self.bits.translate(_POPCOUNT_TABLE)
+        blocks = [0] * (self.BLOCK ** 3)
+        for r in range(256):
+            plane = counts[r << 13:(r + 1) << 13]
+            rb = (r >> 4) << 8
+            for col in range(32):
+                column = plane[col::32]  # 按g排列的256个字节计数
+                bb = col >> 1
+                for gk in range(16):
+                    blocks[rb | (gk << 4) | bb] += sum(column[gk << 4:(gk + 1) << 4])
+        return blocks
+    
+    def count_box(self, r_range: tuple, g_range: tuple, b_range: tuple) -> int:
+        """精确统计RGB盒（各通道闭区间）内已存在颜色的数量
+        
+        b区间在每个 (r, g) 行内是连续的位段，取出对应字节后按掩码计数
+        """
+        (r0, r1), (g0, g1), (b0, b1) = r_range, g_range, b_range
+        if r0 > r1 or g0 > g1 or b0 > b1:
+            return 0
+        byte0, byte1 = b0 >> 3, (b1 >> 3) + 1
+        mask = ((1 << (b1 - b0 + 1)) - 1) << (b0 & 7)
+        bits = self.bits
+        total = 0
+        for r in range(r0, r1 + 1):
+            for g in range(g0, g1 + 1):
+                base = (r << 13) | (g << 5)
+                chunk = int.from_bytes(bits[base + byte0:base + byte1], 'little')
+                total += bin(chunk & mask).count('1')
+        return total
+    
+    def coverage_report(self) -> dict:
+        """计算覆盖率分析：命名比例、空白区域以及按色相/亮度切片的密度"""
+        blocks = self.block_counts()
+        capacity = self.BLOCK ** 3
+        hue_named = [0] * self.HUE_BINS
+        hue_total = [0] * self.HUE_BINS
+        light_named = [0] * self.LIGHTNESS_BINS
+        light_total = [0] * self.LIGHTNESS_BINS
+        grid_named = [[0] * self.HUE_BINS for _ in range(self.LIGHTNESS_BINS)]
+        grid_total = [[0] * self.HUE_BINS for _ in range(self.LIGHTNESS_BINS)]
+        
+        for idx, named in enumerate(blocks):
+            # 以分块中心颜色代表整个分块
+            r = ((idx >> 8) * self.BLOCK + self.BLOCK // 2) / 255
+            g = (((idx >> 4) & 15) * self.BLOCK + self.BLOCK // 2) / 255
+            b = ((idx & 15) * self.BLOCK + self.BLOCK // 2) / 255
+            h, l, _ = colorsys.rgb_to_hls(min(r, 1.0), min(g, 1.0), min(b, 1.0))
+            hi = min(int(h * self.HUE_BINS), self.HUE_BINS - 1)
+            li = min(int(l * self.LIGHTNESS_BINS), self.LIGHTNESS_BINS - 1)
+            hue_named[hi] += named
+            hue_total[hi] += capacity
+            light_named[li] += named
+            light_total[li] += capacity
+            grid_named[li][hi] += named
+            grid_total[li][hi] += capacity
+        
+        def density(named, total):
+            return [n / t if t else None for n, t in zip(named, total)]
+        
+        return {
+            'named': self._count,
+            'percent': self._count / self.SIZE * 100,
+            'empty_blocks': sum(1 for n in blocks if n == 0),
+            'total_blocks': len(blocks),
+            'hue_density': density(hue_named, hue_total),
+            'lightness_density': density(light_named, light_total),
+            'grid_density': [density(n, t) for n, t in zip(grid_named, grid_total)],
+        }
+
+
+# ===== 补全生成任务（在工作进程中执行，必须定义在模块级别） =====
+
+_GAP_BLOCK = ColorPresenceBitmap.BLOCK
+_GAP_GRID = 256 // _GAP_BLOCK
+_GAP_LEAF = 4  # 区域边长不大于该值时逐个颜色计算
+_gap_buckets = None  # 按分块分桶的已命名颜色 (r, g, b, 名称编号)
+_gap_nearest_ring = None  # 每个分块到最近非空分块的切比雪夫距离
+_gap_nonempty = None  # 非空分块坐标列表
+
+
+def _gap_worker_init(buckets, nearest_ring):
+    """工作进程初始化：保存种子分桶"""
+    global _gap_buckets, _gap_nearest_ring, _gap_nonempty
+    _gap_buckets = buckets
+    _gap_nearest_ring = nearest_ring
+    _gap_nonempty = [
+        (idx >> 8, (idx >> 4) & 15, idx & 15)
+        for idx, bucket in enumerate(buckets) if bucket
+    ]
+
+
+def _gap_block_index(x: int, y: int, z: int) -> int:
+    return (x * _GAP_GRID + y) * _GAP_GRID + z
+
+
+def _gap_nearest_rings(buckets: list) -> list:
+    """多源BFS计算每个分块到最近非空分块的切比雪夫距离"""
+    grid = _GAP_GRID
+    dist = [-1] * len(buckets)
+    queue = deque()
+    for idx, bucket in enumerate(buckets):
+        if bucket:
+            dist[idx] = 0
+            queue.append(idx)
+    while queue:
+        idx = queue.popleft()
+        x, y, z = idx >> 8, (idx >> 4) & 15, idx & 15
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    nx, ny, nz = x + dx, y + dy, z + dz
+                    if 0 <= nx < grid and 0 <= ny < grid and 0 <= nz < grid:
+                        nidx = _gap_block_index(nx, ny, nz)
+                        if dist[nidx] < 0:
+                            dist[nidx] = dist[idx] + 1
+                            queue.append(nidx)
+    return dist
+
+
+def _gap_block_gap(d: int) -> int:
+    """两个分块在某一轴上相差d个分块时的最小颜色间距"""
+    d = abs(d)
+    return (d - 1) * _GAP_BLOCK + 1 if d else 0
+
+
+def _gap_seeds_within(x: int, y: int, z: int, radius: int, bound: int = None) -> list:
+    """收集切比雪夫距离不超过radius的分块中的全部种子
+    
+    给出bound时跳过与当前分块最小距离的平方超过bound的分块
+    """
+    if len(_gap_nonempty) < (2 * radius + 1) ** 3:
+        blocks = [
+            (bx, by, bz) for bx, by, bz in _gap_nonempty
+            if max(abs(bx - x), abs(by - y), abs(bz - z)) <= radius
+        ]
+    else:
+        blocks = [
+            (bx, by, bz)
+            for bx in range(max(x - radius, 0), min(x + radius, _GAP_GRID - 1) + 1)
+            for by in range(max(y - radius, 0), min(y + radius, _GAP_GRID - 1) + 1)
+            for bz in range(max(z - radius, 0), min(z + radius, _GAP_GRID - 1) + 1)
+        ]
+    seeds = []
+    for bx, by, bz in blocks:
+        if bound is not None and (
+            _gap_block_gap(bx - x) ** 2 + _gap_block_gap(by - y) ** 2
+            + _gap_block_gap(bz - z) ** 2
+        ) > bound:
+            continue
+        seeds.extend(_gap_buckets[_gap_block_index(bx, by, bz)])
+    return seeds
+
+
+def _gap_far_bound(seeds: list, lo: tuple, size: int) -> int:
+    """各种子到区域最远点距离平方的最小值，即区域内任意点最近邻距离的上界"""
+    lr, lg, lb = lo
+    hr, hg, hb = lr + size - 1, lg + size - 1, lb + size - 1
+    return min(
+        max(r - lr, hr - r) ** 2 + max(g - lg, hg - g) ** 2 + max(b - lb, hb - b) ** 2
+        for r, g, b, _ in seeds
+    )
+
+
+def _gap_prune(seeds: list, lo: tuple, size: int) -> list:
+    """只保留可能成为区域内某个颜色最近邻的种子
+    
+    到区域最近点的距离超过上界的种子不可能是任何点的最近邻
+    """
+    bound = _gap_far_bound(seeds, lo, size)
+    lr, lg, lb = lo
+    hr, hg, hb = lr + size - 1, lg + size - 1, lb + size - 1
+    return [
+        seed for seed in seeds
+        if (lr - seed[0] if seed[0] < lr else max(seed[0] - hr, 0)) ** 2
+        + (lg - seed[1] if seed[1] < lg else max(seed[1] - hg, 0)) ** 2
+        + (lb - seed[2] if seed[2] < lb else max(seed[2] - hb, 0)) ** 2 <= bound
+    ]
+
+
+def _gap_fill_region(lo: tuple, size: int, seeds: list, slab_r0: int,
+                     slab_bits: bytes, out: array):
+    """递归细分区域并为未命名颜色写入最近种子的名称编号"""
+    seeds = _gap_prune(seeds, lo, size)
+    if size > _GAP_LEAF and len(seeds) > 1:
+        half = size // 2
+        for dr in (0, half):
+            for dg in (0, half):
+                for db in (0, half):
+                    _gap_fill_region(
+                        (lo[0] + dr, lo[1] + dg, lo[2] + db), half, seeds,
+                        slab_r0, slab_bits, out
+                    )
+        return
+    
+    r0, g0, b0 = lo
+    for r in range(r0, r0 + size):
+        for g in range(g0, g0 + size):
+            partial = [
+                ((sr - r) * (sr - r) + (sg - g) * (sg - g), sb, nid)
+                for sr, sg, sb, nid in seeds
+            ]
+            base = ((r - slab_r0) << 16) | (g << 8)
+            for b in range(b0, b0 + size):
+                idx = base | b
+                if slab_bits[idx >> 3] & (1 << (idx & 7)):
+                    continue  # 已命名
+                best_d = 1 << 20
+                best = -1
+                for p, sb, nid in partial:
+                    d = p + (sb - b) * (sb - b)
+                    if d < best_d:
+                        best_d = d
+                        best = nid
+                out[idx] = best
+
+
+def _gap_fill_slab(task: tuple) -> tuple:
+    """处理一个r方向的分块层（16个r平面 = 1,048,576种颜色）
+    
+    返回 (起始r, 名称编号数组)，已命名的颜色编号为-1
+    """
+    x, slab_bits = task
+    slab_r0 = x * _GAP_BLOCK
+    out = array('i', [-1]) * (_GAP_BLOCK << 16)
+    for y in range(_GAP_GRID):
+        for z in range(_GAP_GRID):
+            ring = _gap_nearest_ring[_gap_block_index(x, y, z)]
+            candidates = _gap_seeds_within(x, y, z, ring)
+            lo = (slab_r0, y * _GAP_BLOCK, z * _GAP_BLOCK)
+            # 用最近非空分块中的种子得到上界，再据此确定需要搜索的分块
+            far = _gap_far_bound(candidates, lo, _GAP_BLOCK)
+            radius = int(far ** 0.5) // _GAP_BLOCK + 1
+            seeds = _gap_seeds_within(x, y, z, max(radius, ring), far)
+            _gap_fill_region(lo, _GAP_BLOCK, seeds, slab_r0, slab_bits, out)
+    return slab_r0, out
+
+
+def parse_color(text: str):
+    """解析 "#RRGGBB"、"RRGGBB" 或 "r,g,b" 形式的颜色，无法解析时返回None"""
+    text = text.strip()
+    if ',' in text:
+        parts = text.split(',')
+        if len(parts) != 3:
+            return None
+        try:
+            rgb = tuple(int(p) for p in parts)
+        except ValueError:
+            return None
+        return rgb if all(0 <= x <= 255 for x in rgb) else None
+    
+    text = text[1:] if text.startswith('#') else text
+    if len(text) != 6:
+        return None
+    try:
+        value = int(text, 16)
+    except ValueError:
+        return None
+    return (value >> 16) & 255, (value >> 8) & 255, value & 255
+
+
+# ===== 颜色文件格式插件 =====
+
+def _color_row(r, g, b, name) -> tuple:
+    """校验并规范化一条颜色记录，无效时抛出ValueError"""
+    try:
+        r, g, b = int(r), int(g), int(b)
+    except (ValueError, TypeError):
+        raise ValueError(f"非数字的RGB值: {r},{g},{b}")
+    if not (0 <= r <= 255 and 0 <= g <= 255 and 0 <= b <= 255):
+        raise ValueError(f"无效的RGB值: {r},{g},{b}")
+    return r, g, b, str(name).strip()
+
+
+class ColorFormat:
+    """颜色文件格式插件基类
+    
+    read(stream, batch_size, reject) 分批产出 (r, g, b, name) 列表，无效记录交给
+    reject(行号, 原因, 原始内容) 处理；write(stream, batches) 消费同样的批次。文本格式收到
+    文本流，binary为True的格式收到二进制流
+    """
+    
+    key = ''
+    label = ''
+    extensions = ()
+    binary = False
+    unit = '行'  # reject中位置编号的单位
+    
+    def sniff(self, head: bytes) -> bool:
+        """根据文件开头的内容判断是否为本格式"""
+        return False
+    
+    def read(self, stream, batch_size: int, reject):
+        raise NotImplementedError
+    
+    def write(self, stream, batches) -> int:
+        raise NotImplementedError
+
+
+COLOR_FORMATS = []  # 已注册的格式，按内容识别时依次尝试
+SNIFF_BYTES = 4096  # 内容识别读取的文件开头长度
+
+
+def register_format(cls):
+    """注册颜色文件格式插件（类装饰器）"""
+    COLOR_FORMATS.append(cls())
+    return cls
+
+
+def _head_text(head: bytes) -> str:
+    """将文件开头解码为文本（末尾可能截断多字节字符）"""
+    return head.decode('utf-8-sig', errors='ignore')
+
+
+def _is_hex_token(token: str) -> bool:
+    """是否为 "#RRGGBB" 或 "RRGGBB" 形式的十六进制颜色"""
+    token = token[1:] if token.startswith('#') else token
+    return len(token) == 6 and all(c in '0123456789abcdefABCDEF' for c in token)
+
+
+def _first_data_line(head: bytes) -> str:
+    """返回文件开头第一个非空、非注释的行（"#RRGGBB" 不视为注释）"""
+    for line in _head_text(head).splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(('#', ';', '//')) and not _is_hex_token(line.split()[0]):
+            continue
+        return line
+    return ''
+
+
+class _DelimitedFormat(ColorFormat):
+    """以分隔符分列的文本：R, G, B, 名称，可带标题行"""
+    
+    delimiter = ','
+    
+    def read(self, stream, batch_size: int, reject):
+        reader = csv.reader(stream, delimiter=self.delimiter)
+        batch = []
+        for row in reader:
+            if reader.line_num == 1 and any(
+                cell.strip().lower() in ('r', 'red', 'name') for cell in row
+            ):
+                continue  # 标题行
+            if not row:
+                continue
+            try:
+                if len(row) < 4:
+                    raise ValueError(f"列数不足: 需要4列，实际 {len(row)} 列")
+                batch.append(_color_row(row[0], row[1], row[2], row[3]))
+            except ValueError as e:
+                reject(reader.line_num, str(e), self.delimiter.join(row))
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def write(self, stream, batches) -> int:
+        writer = csv.writer(stream, delimiter=self.delimiter)
+        writer.writerow(['R', 'G', 'B', '颜色名称'])
+        count = 0
+        for batch in batches:
+            writer.writerows(batch)
+            count += len(batch)
+        return count
+
+
+@register_format
+class AseFormat(ColorFormat):
+    """Adobe色板交换格式（.ase）：大端序二进制，RGB/灰度颜色以0-1浮点数保存"""
+    
+    key = 'ase'
+    label = "Adobe色板"
+    extensions = ('.ase',)
+    binary = True
+    unit = '块'
+    MAGIC = b'ASEF'
+    HEADER = struct.Struct('>4sHHI')  # 魔数, 主版本, 次版本, 块数量
+    BLOCK = struct.Struct('>HI')  # 块类型, 块长度
+    COLOR_ENTRY = 0x0001
+    
+    def sniff(self, head: bytes) -> bool:
+        return head.startswith(self.MAGIC)
+    
+    def read(self, stream, batch_size: int, reject):
+        header = stream.read(self.HEADER.size)
+        if len(header) != self.HEADER.size or not header.startswith(self.MAGIC):
+            raise ValueError("不是有效的ASE文件")
+        _, _, _, block_count = self.HEADER.unpack(header)
+        batch = []
+        for index in range(1, block_count + 1):
+            block_header = stream.read(self.BLOCK.size)
+            if len(block_header) != self.BLOCK.size:
+                raise ValueError(f"ASE文件在第 {index} 块处截断")
+            block_type, length = self.BLOCK.unpack(block_header)
+            data = stream.read(length)
+            if block_type != self.COLOR_ENTRY:
+                continue  # 分组开始/结束
+            try:
+                batch.append(self._parse_color(data))
+            except (ValueError, struct.error, UnicodeDecodeError) as e:
+                reject(index, str(e), data.hex())
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    @staticmethod
+    def _parse_color(data: bytes) -> tuple:
+        (name_len,) = struct.unpack_from('>H', data)
+        name_end = 2 + name_len * 2
+        name = data[2:name_end].decode('utf-16-be').rstrip('\0')
+        model = data[name_end:name_end + 4]
+        if model == b'RGB ':
+            values = struct.unpack_from('>3f', data, name_end + 4)
+        elif model == b'Gray':
+            values = struct.unpack_from('>f', data, name_end + 4) * 3
+        else:
+            raise ValueError(f"不支持的颜色模式: {model.decode('ascii', 'replace').strip()}")
+        r, g, b = (round(v * 255) for v in values)
+        return _color_row(r, g, b, name)
+    
+    def write(self, stream, batches) -> int:
+        # 块数量在写完后回填，写入过程中不需要知道总数
+        stream.write(self.HEADER.pack(self.MAGIC, 1, 0, 0))
+        count = 0
+        for batch in batches:
+            chunks = []
+            for r, g, b, name in batch:
+                encoded = (name + '\0').encode('utf-16-be')
+                body = (struct.pack('>H', len(encoded) // 2) + encoded + b'RGB '
+                        + struct.pack('>3fH', r / 255, g / 255, b / 255, 2))
+                chunks.append(self.BLOCK.pack(self.COLOR_ENTRY, len(body)))
+                chunks.append(body)
+            stream.write(b''.join(chunks))
+            count += len(batch)
+        stream.seek(0)
+        stream.write(self.HEADER.pack(self.MAGIC, 1, 0, count))
+        stream.seek(0, os.SEEK_END)
+        return count
+
+
+@register_format
+class GimpPaletteFormat(ColorFormat):
+    """GIMP调色板（.gpl）：以 "GIMP Palette" 开头，每行 "R G B 名称" """
+    
+    key = 'gpl'
+    label = "GIMP调色板"
+    extensions = ('.gpl',)
+    
+    def sniff(self, head: bytes) -> bool:
+        return _head_text(head).lstrip().startswith('GIMP Palette')
+    
+    def read(self, stream, batch_size: int, reject):
+        batch = []
+        for line_no, line in enumerate(stream, 1):
+            line = line.strip()
+            if (not line or line.startswith('#') or line == 'GIMP Palette'
+                    or line.startswith(('Name:', 'Columns:'))):
+                continue
+            parts = line.split(None, 3)
+            try:
+                if len(parts) < 3:
+                    raise ValueError(f"列数不足: 需要R G B三个数值，实际 {len(parts)} 个")
+                batch.append(_color_row(parts[0], parts[1], parts[2],
+                                        parts[3] if len(parts) > 3 else ''))
+            except ValueError as e:
+                reject(line_no, str(e), line)
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def write(self, stream, batches) -> int:
+        stream.write("GIMP Palette\nName: ColorDatabase\nColumns: 16\n#\n")
+        count = 0
+        for batch in batches:
+            stream.write(''.join(f"{r:3d} {g:3d} {b:3d}\t{name}\n" for r, g, b, name in batch))
+            count += len(batch)
+        return count
+
+
+@register_format
+class JsonFormat(ColorFormat):
+    """JSON数组：[{"r": 255, "g": 0, "b": 0, "name": "..."}, ...]
+    
+    逐个解码数组元素，不会把整个文件读入内存
+    """
+    
+    key = 'json'
+    label = "JSON文件"
+    extensions = ('.json',)
+    unit = '项'
+    CHUNK = 1 << 16
+    MAX_ITEM = 1 << 20  # 单个数组元素的最大长度，避免格式错误时把整个文件读入内存
+    
+    def sniff(self, head: bytes) -> bool:
+        return _head_text(head).lstrip().startswith('[')
+    
+    def _items(self, stream):
+        """从文本流中逐个解码JSON数组的元素"""
+        decoder = json.JSONDecoder()
+        buffer = stream.read(self.CHUNK).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError("JSON文件应该包含颜色数组")
+        pos = 1
+        eof = False
+        while True:
+            # 跳过空白和逗号
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if eof:
+                    raise ValueError("JSON文件格式不完整")
+                if len(buffer) - pos > self.MAX_ITEM:
+                    raise ValueError("JSON数组元素过大或格式错误")
+                chunk = stream.read(self.CHUNK)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+            pos = end
+            if pos > self.CHUNK:
+                buffer = buffer[pos:]
+                pos = 0
+    
+    def read(self, stream, batch_size: int, reject):
+        batch = []
+        for index, item in enumerate(self._items(stream), 1):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("无效的颜色数据格式")
+                batch.append(_color_row(
+                    item.get('r', item.get('red', 0)),
+                    item.get('g', item.get('green', 0)),
+                    item.get('b', item.get('blue', 0)),
+                    item.get('name', '')
+                ))
+            except ValueError as e:
+                reject(index, str(e), json.dumps(item, ensure_ascii=False))
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def write(self, stream, batches) -> int:
+        stream.write('[\n')
+        count = 0
+        for batch in batches:
+            items = ',\n'.join(
+                json.dumps({"r": r, "g": g, "b": b, "name": name}, ensure_ascii=False)
+                for r, g, b, name in batch
+            )
+            stream.write((',\n' if count else '') + items)
+            count += len(batch)
+        stream.write('\n]')
+        return count
+
+
+@register_format
+class HexListFormat(ColorFormat):
+    """十六进制颜色列表：每行 "#RRGGBB 名称"，名称可省略"""
+    
+    key = 'hex'
+    label = "十六进制列表"
+    extensions = ('.hex', '.txt')
+    
+    def sniff(self, head: bytes) -> bool:
+        line = _first_data_line(head)
+        return bool(line) and _is_hex_token(line.split()[0])
+    
+    def read(self, stream, batch_size: int, reject):
+        batch = []
+        for line_no, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line or line.startswith((';', '//')):
+                continue
+            parts = line.split(None, 1)
+            if not _is_hex_token(parts[0]):
+                if line.startswith('#'):
+                    continue  # 注释行
+                reject(line_no, "无效的十六进制颜色", line)
+                continue
+            value = int(parts[0].lstrip('#'), 16)
+            batch.append((value >> 16, (value >> 8) & 255, value & 255,
+                          parts[1].strip() if len(parts) > 1 else ''))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def write(self, stream, batches) -> int:
+        count = 0
+        for batch in batches:
+            stream.write(''.join(f"#{r:02X}{g:02X}{b:02X} {name}\n" for r, g, b, name in batch))
+            count += len(batch)
+        return count
+
+
+@register_format
+class TsvFormat(_DelimitedFormat):
+    """制表符分隔的文本"""
+    
+    key = 'tsv'
+    label = "TSV文件"
+    extensions = ('.tsv', '.tab')
+    delimiter = '\t'
+    
+    def sniff(self, head: bytes) -> bool:
+        line = _first_data_line(head)
+        return '\t' in line and line.count('\t') >= line.count(',')
+
+
+@register_format
+class CsvFormat(_DelimitedFormat):
+    """逗号分隔的文本"""
+    
+    key = 'csv'
+    label = "CSV文件"
+    extensions = ('.csv',)
+    
+    def sniff(self, head: bytes) -> bool:
+        return ',' in _first_data_line(head)
+
+
+def format_for_path(path: str) -> ColorFormat:
+    """按扩展名查找格式（用于导出），不支持时抛出ValueError"""
+    ext = os.path.splitext(path)[1].lower()
+    for fmt in COLOR_FORMATS:
+        if ext in fmt.extensions:
+            return fmt
+    raise ValueError(f"不支持的文件格式: {ext or '无扩展名'}")
+
+
+def detect_format(path: str) -> ColorFormat:
+    """根据文件开头的内容识别格式，无法识别时再参考扩展名"""
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    if not head.strip():
+        raise ValueError("文件为空")
+    for fmt in COLOR_FORMATS:
+        if fmt.sniff(head):
+            return fmt
+    return format_for_path(path)
+
+
+def format_filetypes() -> list:
+    """文件对话框使用的文件类型列表"""
+    return [
+        (fmt.label, ' '.join('*' + ext for ext in fmt.extensions))
+        for fmt in sorted(COLOR_FORMATS, key=lambda fmt: fmt.key != 'csv')
+    ] + [("所有文件", "*.*")]
+
+
+class RejectSink:
+    """导入时的无效记录收集器
+    
+    无效记录连同位置和原因以缓冲方式写入旁路CSV文件，原因按类别计数，
+    导入结束后只汇总显示一次；拒绝率超过错误预算时中止导入
+    
+    明细文件在出现第一条无效记录时才创建，不覆盖已有文件（改用带序号的文件名）；
+    导入文件所在目录不可写时改写到临时目录，仍无法写入时只计数不保存明细
+    """
+    
+    MIN_SAMPLE = 1000  # 处理到该位置之后才检查拒绝率，避免文件开头的少量坏行导致误判
+    BUFFER_SIZE = 1 << 16
+    
+    def __init__(self, path: str, budget: float = 1.0, unit: str = '行'):
+        self.path = path
+        self.budget = budget  # 允许的最大拒绝率 (0-1)，1表示不限制
+        self.unit = unit
+        self.count = 0
+        self.reasons = {}
+        self._file = None
+        self._writer = None
+        self._opened = False
+    
+    def _open(self):
+        """在第一条无效记录出现时创建明细文件，依次尝试导入文件旁和临时目录"""
+        self._opened = True
+        base = self.path[:-len('.csv')] if self.path.endswith('.csv') else self.path
+        for folder in (os.path.dirname(base), tempfile.gettempdir()):
+            stem = os.path.join(folder, os.path.basename(base))
+            for n in range(1000):
+                path = f"{stem}.csv" if n == 0 else f"{stem}-{n}.csv"
+                try:
+                    # 'x'模式遇到已存在的文件会失败，从而保留之前导入留下的明细
+                    self._file = open(path, 'x', encoding='utf-8', newline='',
+                                      buffering=self.BUFFER_SIZE)
+                except FileExistsError:
+                    continue
+                except OSError:
+                    break  # 目录不可写，改用下一个目录
+                self.path = path
+                self._writer = csv.writer(self._file)
+                self._writer.writerow([self.unit, '原因', '原始内容'])
+                return
+        self.path = None
+    
+    def __call__(self, position: int, reason: str, raw: str = ''):
+        if not self._opened:
+            self._open()
+        if self._writer is not None:
+            self._writer.writerow((position, reason, raw))
+        self.count += 1
+        category = reason.split(':', 1)[0]
+        self.reasons[category] = self.reasons.get(category, 0) + 1
+        
+        if position >= self.MIN_SAMPLE and self.count / position > self.budget:
+            self.close()
+            raise ValueError(
+                f"拒绝率 {self.count / position:.1%} 超过错误预算 {self.budget:.0%}，"
+                f"导入已在第 {position} {self.unit}处中止 ({self.summary()})"
+            )
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+    
+    def summary(self) -> str:
+        """按出现次数排列的拒绝原因汇总"""
+        reasons = sorted(self.reasons.items(), key=lambda item: -item[1])
+        text = ", ".join(f"{reason} x{n:,}" for reason, n in reasons)
+        where = f"明细见 {self.path}" if self.path else "明细文件无法写入，未保存"
+        return f"无效记录 {self.count:,} 条: {text}; {where}"
+
+
+def _estimate_size(obj) -> int:
+    """估算缓存条目占用的内存（递归计算元组和列表中的元素）"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        size += sum(_estimate_size(item) for item in obj)
+    return size
+
+
+class LRUCache:
+    """按条目数和估算内存双重限制的LRU缓存
+    
+    每次读写都带上数据库的代数，代数变化说明数据已被修改，缓存整体失效
+    """
+    
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 << 20):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # 键 -> (值, 估算字节数)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries
+                                or self.bytes > self.max_bytes):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+    
+    def _check_generation(self, generation):
+        if generation != self.generation:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.bytes = 0
+            self.generation = generation
+    
+    def resize(self, max_entries: int, max_bytes: int):
+        """调整容量上限，超出部分立即淘汰"""
+        with self.lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+    
+    def get(self, key, generation) -> tuple:
+        """返回 (是否命中, 值)，未找到的结果（None）同样可以被缓存"""
+        with self.lock:
+            self._check_generation(generation)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+    
+    def put(self, key, value, generation):
+        with self.lock:
+            self._check_generation(generation)
+            if self.max_entries <= 0:
+                return
+            size = _estimate_size(key) + _estimate_size(value)
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            self._evict()
+    
+    def clear(self):
+        with self.lock:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.bytes = 0
+    
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _readonly_uri(path: str) -> str:
+    """构造只读打开数据库的URI，路径中的 #、?、% 等字符需要转义"""
+    return f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+
+
+class ColorQueryEngine:
+    """通过ATTACH联合查询多个调色板数据库
+    
+    数据源按优先级排列（main为主数据库），同一RGB在多个数据源中
+    名称不同时采用优先级最高的数据源中的名称
+    """
+    
+    MAX_SOURCES = 9  # SQLite默认最多同时附加10个数据库（含main）
+    
+    def __init__(self, db_path: str, log=None):
+        self.db_path = db_path
+        self.log = log or (lambda message: None)  # 数据源不可用等提示信息的输出
+        self.config_path = db_path + ".sources.json"
+        self.paths = {'main': db_path}  # 别名 -> 文件路径
+        self.order = ['main']  # 优先级顺序，靠前的优先
+        self.cache = LRUCache()  # 精确查找、最近颜色和名称搜索的结果缓存
+        self.queries = {}  # 已保存的导出查询 {名称: 筛选条件}
+        self.unavailable = {}  # 文件丢失等原因无法附加的数据源 {别名: 错误信息}，查询时跳过
+        self.load_config()
+        # 所有数据库操作都通过连接管理器获取连接，只读连接附加全部数据源
+        self.connections = ConnectionManager(
+            db_path, lambda: self.connect(check_same_thread=False)
+        )
+    
+    def load_config(self):
+        """读取已注册的数据源和已保存的导出查询"""
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            return
+        for item in config.get('sources', []):
+            self.paths[item['alias']] = item['path']
+        order = [alias for alias in config.get('order', []) if alias in self.paths]
+        self.order = order + [alias for alias in self.paths if alias not in order]
+        for name, spec in config.get('queries', {}).items():
+            self.queries[name] = {
+                key: tuple(value) if isinstance(value, list) else value
+                for key, value in spec.items()
+            }
+    
+    def save_config(self):
+        """保存已注册的数据源及其优先级，以及已保存的导出查询"""
+        config = {
+            'sources': [
+                {'alias': alias, 'path': path}
+                for alias, path in self.paths.items() if alias != 'main'
+            ],
+            'order': self.order,
+            'queries': self.queries,
+        }
+        with open(self.config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+    
+    @property
+    def active_order(self) -> list:
+        """按优先级排列的当前可用数据源"""
+        return [alias for alias in self.order if alias not in self.unavailable]
+    
+    @property
+    def federated(self) -> bool:
+        return len(self.active_order) > 1
+    
+    def _available_sources(self) -> list:
+        """借用一次连接（新建连接时会检测不可用的数据源），再返回可用数据源"""
+        with self.connections.read():
+            return self.active_order
+    
+    def add_source(self, path: str) -> str:
+        """注册一个数据库文件，返回其别名"""
+        path = os.path.abspath(path)
+        if path in (os.path.abspath(p) for p in self.paths.values()):
+            raise ValueError("该数据库已注册")
+        if len(self.paths) > self.MAX_SOURCES:
+            raise ValueError(f"最多只能附加 {self.MAX_SOURCES} 个数据库")
+        conn = sqlite3.connect(_readonly_uri(path), uri=True)
+        try:
+            conn.execute("SELECT r, g, b, name FROM colors LIMIT 1")
+        except sqlite3.Error:
+            raise ValueError("所选文件不是有效的颜色数据库")
+        finally:
+            conn.close()
+        
+        n = 1
+        while f"src{n}" in self.paths:
+            n += 1
+        alias = f"src{n}"
+        self.paths[alias] = path
+        self.order.append(alias)
+        self.save_config()
+        self.cache.clear()
+        self.connections.readers.reset()  # 附加的数据源已改变
+        return alias
+    
+    def remove_source(self, alias: str):
+        """取消注册数据源（主数据库不能移除）"""
+        if alias == 'main':
+            raise ValueError("不能移除主数据库")
+        del self.paths[alias]
+        self.order.remove(alias)
+        self.unavailable.pop(alias, None)
+        self.save_config()
+        self.cache.clear()
+        self.connections.readers.reset()  # 附加的数据源已改变
+    
+    def move_source(self, alias: str, delta: int):
+        """调整数据源的优先级，delta为负表示提前"""
+        i = self.order.index(alias)
+        j = max(0, min(len(self.order) - 1, i + delta))
+        self.order.insert(j, self.order.pop(i))
+        self.save_config()
+        self.cache.clear()
+        self.connections.readers.reset()  # 附加的数据源已改变
+    
+    def connect(self, check_same_thread: bool = True):
+        """以只读方式打开主数据库并附加已注册的数据源（通常由连接管理器调用）
+        
+        无法打开的数据源（文件被移动或删除）记录到unavailable中并跳过，
+        不影响主数据库和其他数据源的查询
+        """
+        conn = sqlite3.connect(_readonly_uri(self.db_path), uri=True,
+                               check_same_thread=check_same_thread,
+                               cached_statements=ConnectionManager.STATEMENT_CACHE)
+        for pragma in ConnectionManager.READER_PRAGMAS:
+            conn.execute(pragma)
+        for alias in self.order:
+            if alias == 'main':
+                continue
+            try:
+                conn.execute(
+                    f'ATTACH DATABASE ? AS "{alias}"',
+                    (_readonly_uri(self.paths[alias]),)
+                )
+            except sqlite3.Error as e:
+                if alias not in self.unavailable:
+                    self.unavailable[alias] = str(e)
+                    self.log(f"附加数据库 {alias} 不可用，查询时将跳过: {self.paths[alias]} ({e})")
+                    self.cache.clear()  # 缓存中可能有来自该数据源的结果
+                continue
+            if self.unavailable.pop(alias, None) is not None:
+                self.log(f"附加数据库 {alias} 已恢复: {self.paths[alias]}")
+                self.cache.clear()
+                self.connections.readers.reset()  # 之前建立的连接没有附加该数据源
+        return conn
+    
+    def _fan_out(self, task):
+        """在每个可用数据源上并行执行task(conn, alias)，按优先级顺序返回 [(别名, 结果)]
+        
+        每个线程从连接池取得自己的连接，SQLite执行查询时会释放GIL
+        """
+        def run(alias):
+            with self.connections.read() as conn:
+                return task(conn, alias)
+        
+        order = self._available_sources()
+        if len(order) == 1:
+            return [('main', run('main'))]
+        with ThreadPoolExecutor(max_workers=len(order)) as executor:
+            return list(zip(order, executor.map(run, order)))
+    
+    @staticmethod
+    def read_generation(conn) -> int:
+        """读取主数据库的数据代数，每次写入都会使其加一"""
+        try:
+            row = conn.execute(STATEMENTS['read_generation']).fetchone()
+        except sqlite3.OperationalError:  # 旧版本创建的数据库没有meta表
+            return 0
+        return row[0] if row else 0
+    
+    @staticmethod
+    def write_generation(conn, generation: int = None):
+        """设置数据代数（默认在当前值上加一），需与数据修改在同一事务中执行"""
+        if generation is None:
+            generation = ColorQueryEngine.read_generation(conn) + 1
+        conn.execute(STATEMENTS['write_generation'], (generation,))
+    
+    def _cached(self, key, conn, compute, generation: int = None):
+        """先查缓存，未命中时计算并写入缓存
+        
+        generation为调用方已读取的数据代数（批量查询时每批只读一次），
+        未提供时在这里读取
+        """
+        if generation is None:
+            if conn is None:
+                with self.connections.read_main() as conn:
+                    generation = self.read_generation(conn)
+            else:
+                generation = self.read_generation(conn)
+        hit, value = self.cache.get(key, generation)
+        if hit:
+            return value
+        value = compute()
+        self.cache.put(key, value, generation)
+        return value
+    
+    def lookup(self, conn, r: int, g: int, b: int, generation: int = None):
+        """精确查找颜色名称，返回 (名称, 数据源别名) 或None"""
+        return self._cached(('exact', r, g, b), conn, lambda: self._lookup(conn, r, g, b),
+                            generation)
+    
+    def _lookup(self, conn, r: int, g: int, b: int):
+        order = self.active_order
+        sql = " UNION ALL ".join(
+            f'SELECT name, {prio} FROM "{alias}".colors WHERE r = ? AND g = ? AND b = ?'
+            for prio, alias in enumerate(order)
+        )
+        row = conn.execute(
+            f"SELECT * FROM ({sql}) ORDER BY 2 LIMIT 1",
+            (r, g, b) * len(order)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], order[row[1]]
+    
+    NEAREST_RADII = (2, 8, 32, 128)  # 最近颜色搜索的逐级扩大的立方体半径
+    
+    def nearest(self, conn, r: int, g: int, b: int, generation: int = None):
+        """查找欧氏距离最近的颜色，返回 (r, g, b, 名称, 数据源别名, 距离平方) 或None"""
+        return self._cached(('nearest', r, g, b), conn, lambda: self._nearest(conn, r, g, b),
+                            generation)
+    
+    def _nearest(self, conn, r: int, g: int, b: int):
+        """在以目标为中心的立方体内搜索，r和g使用IN列表让主键索引逐个定位，
+        找到的距离不超过立方体半径时即为全局最近，否则扩大半径继续搜索
+        """
+        # 使用编号参数，各数据源共用同一组参数；SQL文本只取决于半径，可以命中语句缓存
+        dist = "(r - ?1) * (r - ?1) + (g - ?2) * (g - ?2) + (b - ?3) * (b - ?3)"
+        order = self.active_order
+        radius_iter = iter(self.NEAREST_RADII)
+        radius = next(radius_iter)
+        while True:
+            if radius >= 255:
+                where = ""
+                params = (r, g, b)
+            else:
+                # 越界的值截断到边界（IN列表中重复无妨），列表长度固定为 2*radius+1
+                n = 2 * radius + 1
+                r_marks = ",".join(f"?{i}" for i in range(6, 6 + n))
+                g_marks = ",".join(f"?{i}" for i in range(6 + n, 6 + 2 * n))
+                where = f"WHERE r IN ({r_marks}) AND g IN ({g_marks}) AND b BETWEEN ?4 AND ?5"
+                params = (
+                    (r, g, b, max(b - radius, 0), min(b + radius, 255))
+                    + tuple(min(max(r + d, 0), 255) for d in range(-radius, radius + 1))
+                    + tuple(min(max(g + d, 0), 255) for d in range(-radius, radius + 1))
+                )
+            sql = " UNION ALL ".join(
+                f'SELECT r, g, b, name, {prio}, {dist} FROM "{alias}".colors {where}'
+                for prio, alias in enumerate(order)
+            )
+            row = conn.execute(
+                f"SELECT * FROM ({sql}) ORDER BY 6, 5 LIMIT 1", params
+            ).fetchone()
+            if row is not None and (row[5] <= radius * radius or radius >= 255):
+                return row[0], row[1], row[2], row[3], order[row[4]], row[5]
+            if row is None and radius >= 255:
+                return None
+            # 立方体内的结果不一定是全局最近，扩大到能覆盖该距离的半径
+            radius = max(next(radius_iter, 255), int(row[5] ** 0.5) + 1 if row else 0)
+    
+    def search(self, pattern: str, limit: int = 100) -> list:
+        """按名称模糊搜索，返回 [(r, g, b, 名称, 数据源别名)]"""
+        return self._cached(('search', pattern, limit), None,
+                            lambda: self._search(pattern, limit))
+    
+    def _search(self, pattern: str, limit: int) -> list:
+        """各数据源并行扫描，同一RGB只保留优先级最高的结果"""
+        # 搜索词按字面匹配，其中的 %、_ 不作为LIKE通配符
+        escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        
+        def task(conn, alias):
+            return conn.execute(
+                f'SELECT r, g, b, name FROM "{alias}".colors WHERE name LIKE ? ESCAPE \'\\\' LIMIT ?',
+                (f"%{escaped}%", limit)
+            ).fetchall()
+        
+        results = []
+        seen = set()
+        for alias, rows in self._fan_out(task):
+            for r, g, b, name in rows:
+                if (r, g, b) not in seen:
+                    seen.add((r, g, b))
+                    results.append((r, g, b, name, alias))
+        return results[:limit]
+    
+    # 导出排序方式 -> ORDER BY子句，分别由主键索引、名称索引和rowid直接提供顺序
+    EXPORT_ORDERS = {
+        'rgb': "ORDER BY r, g, b",
+        'name': "ORDER BY name",
+        'insert': "ORDER BY rowid",
+    }
+    
+    @staticmethod
+    def filter_sql(spec: dict) -> tuple:
+        """将导出筛选条件转换为WHERE子句和参数
+        
+        spec可包含：'r'/'g'/'b' 通道闭区间，'name' GLOB模式（* 和 ?，区分大小写），
+        'rowid' 插入序号闭区间。RGB区间命中主键索引，rowid区间直接定位表B树，
+        带固定前缀的名称模式可使用名称索引
+        """
+        clauses = []
+        params = []
+        for channel in 'rgb':
+            if spec.get(channel):
+                clauses.append(f"{channel} BETWEEN ? AND ?")
+                params.extend(spec[channel])
+        if spec.get('name'):
+            clauses.append("name GLOB ?")
+            params.append(spec['name'])
+        if spec.get('rowid'):
+            clauses.append("rowid BETWEEN ? AND ?")
+            params.extend(spec['rowid'])
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return where, params
+    
+    @staticmethod
+    def glob_prefix(pattern: str) -> str:
+        """GLOB模式开头的固定前缀（第一个通配符之前的部分），只有非空前缀才能使用名称索引"""
+        for i, ch in enumerate(pattern):
+            if ch in '*?[':
+                return pattern[:i]
+        return pattern
+    
+    def has_name_index(self) -> bool:
+        with self.connections.read_main() as conn:
+            return conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_name'"
+            ).fetchone() is not None
+    
+    def ensure_name_index(self) -> bool:
+        """按名称筛选或排序前创建名称索引，返回是否新建了索引"""
+        with self.connections.write() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_name'"
+            ).fetchone()
+            if exists:
+                return False
+            conn.execute("CREATE INDEX idx_name ON colors(name)")
+            conn.commit()
+        # 缓存的EXPLAIN语句不会因架构变化重新编译，丢弃旧连接以免记录过时的查询计划
+        self.connections.readers.reset()
+        return True
+    
+    def estimate_rows(self, spec: dict = None, bitmap: ColorPresenceBitmap = None) -> tuple:
+        """估算导出行数，不执行COUNT(*)；返回 (估计行数, 各数据源的查询计划)
+        
+        每个数据源取若干上界中的最小值：表的MAX(rowid)、rowid区间的跨度，
+        主数据库还可以用存在位图精确统计总数和RGB盒内的数量。查询计划
+        （EXPLAIN QUERY PLAN）一并返回，用于确认筛选条件命中了索引
+        """
+        spec = spec or {}
+        where, params = self.filter_sql(spec)
+        box = tuple(spec.get(channel) or (0, 255) for channel in 'rgb')
+        
+        def task(conn, alias):
+            plan = " / ".join(
+                row[-1] for row in conn.execute(
+                    f'EXPLAIN QUERY PLAN SELECT r, g, b, name FROM "{alias}".colors{where}',
+                    params
+                )
+            )
+            max_rowid = conn.execute(
+                f'SELECT MAX(rowid) FROM "{alias}".colors'
+            ).fetchone()[0] or 0
+            bounds = [max_rowid]
+            if alias == 'main' and bitmap is not None:
+                bounds.append(len(bitmap))
+                if any(spec.get(channel) for channel in 'rgb'):
+                    bounds.append(bitmap.count_box(*box))
+            if spec.get('rowid'):
+                lo, hi = spec['rowid']
+                bounds.append(max(0, min(hi, max_rowid) - max(lo, 1) + 1))
+            return min(bounds), plan
+        
+        results = self._fan_out(task)
+        plans = [f"[{alias}] {plan}" for alias, (_, plan) in results]
+        return sum(estimate for _, (estimate, _) in results), plans
+    
+    def save_query(self, name: str, spec: dict):
+        """保存导出查询，同名查询会被覆盖"""
+        self.queries[name] = dict(spec)
+        self.save_config()
+    
+    def iter_colors(self, batch_size: int, spec: dict = None):
+        """分批产出颜色 (r, g, b, name)，spec为导出筛选条件（见filter_sql）
+        
+        只有主数据库时按spec['order']排序（默认存储顺序）读取；联合查询时各数据源
+        在独立线程中按主键顺序流式读取，再多路归并，相同RGB取优先级最高的名称
+        """
+        spec = spec or {}
+        where, params = self.filter_sql(spec)
+        if not self.federated:
+            order = self.EXPORT_ORDERS.get(spec.get('order'), "")
+            with self.connections.read() as conn:
+                cursor = conn.execute(f"SELECT r, g, b, name FROM colors{where} {order}", params)
+                try:
+                    while True:
+                        batch = cursor.fetchmany(batch_size)
+                        if not batch:
+                            break
+                        yield batch
+                finally:
+                    cursor.close()  # 提前结束时释放读事务，再归还连接
+            return
+        
+        stop = threading.Event()
+        
+        def produce(alias, queue):
+            try:
+                with self.connections.read() as conn:
+                    cursor = conn.execute(
+                        f'SELECT r, g, b, name FROM "{alias}".colors{where} ORDER BY r, g, b',
+                        params
+                    )
+                    try:
+                        while not stop.is_set():
+                            rows = cursor.fetchmany(batch_size)
+                            if not rows:
+                                break
+                            queue.put(rows)
+                    finally:
+                        cursor.close()
+                queue.put(None)
+            except Exception as e:
+                queue.put(e)
+        
+        def consume(queue):
+            while True:
+                rows = queue.get()
+                if rows is None:
+                    return
+                if isinstance(rows, Exception):
+                    raise rows
+                yield from rows
+        
+        sources = self._available_sources()
+        queues = [Queue(maxsize=4) for _ in sources]
+        workers = [
+            threading.Thread(target=produce, args=(alias, queue), daemon=True)
+            for alias, queue in zip(sources, queues)
+        ]
+        for worker in workers:
+            worker.start()
+        
+        try:
+            # heapq.merge对相等的键保持输入顺序，即优先级顺序
+            merged = heapq.merge(*(consume(q) for q in queues), key=lambda row: row[:3])
+            batch = []
+            last_key = None
+            for row in merged:
+                key = row[:3]
+                if key == last_key:
+                    continue
+                last_key = key
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            stop.set()
+            for queue in queues:  # 唤醒可能阻塞在put上的线程
+                while not queue.empty():
+                    queue.get_nowait()
+
+
+class ReadOnlyConnectionPool:
+    """只读连接池：连接在请求之间复用，数据库文件被替换后自动重建
+    
+    没有空闲连接时直接新建而不等待，嵌套获取连接（如联合查询的并行扫描）
+    不会死锁；池中最多保留size个空闲连接，多出的连接在归还时关闭
+    """
+    
+    def __init__(self, factory, size: int = 8):
+        self.factory = factory
+        self.size = size
+        self.idle = Queue()
+        self.generation = 0
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """取出一个空闲连接，没有空闲连接时新建"""
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+        with self.lock:
+            generation = self.generation
+        return generation, self.factory()
+    
+    def release(self, item):
+        """归还连接，属于旧文件或超出容量的连接直接关闭"""
+        generation, conn = item
+        with self.lock:
+            keep = generation == self.generation and self.idle.qsize() < self.size
+        if keep:
+            self.idle.put(item)
+        else:
+            conn.close()
+    
+    def reset(self):
+        """关闭所有空闲连接，正在使用的连接在归还时关闭"""
+        with self.lock:
+            self.generation += 1
+        while True:
+            try:
+                _, conn = self.idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+
+
+class ConnectionManager:
+    """数据库连接管理器，所有数据库操作都通过它获取连接
+    
+    - 唯一的写连接长期保持，写操作在写锁内串行执行
+    - 只读连接放在连接池中，在操作之间复用，使用期间只属于一个线程
+    - PRAGMA只在建立连接时执行一次，连接的语句缓存容量较大，
+      配合STATEMENTS登记表，常用SQL不会被重复编译
+    - 数据库文件被替换前调用close_all()，之后按需重新打开
+    """
+    
+    STATEMENT_CACHE = 512  # 每个连接缓存的已编译语句数量（sqlite3默认128）
+    WRITER_PRAGMAS = (
+        "PRAGMA journal_mode=WAL",  # 只读连接查询时不会阻塞写入（对数据库文件持久生效）
+        "PRAGMA cache_size=-32768",  # 32MB页缓存，写连接长期保持，缓存在操作之间持续有效
+    )
+    READER_PRAGMAS = (
+        "PRAGMA cache_size=-8192",
+    )
+    
+    def __init__(self, db_path: str, reader_factory, pool_size: int = 8):
+        self.db_path = db_path
+        self.readers = ReadOnlyConnectionPool(reader_factory, pool_size)
+        # 只访问主数据库的维护操作使用不附加数据源的连接，附加的文件丢失时不受影响
+        self.main_readers = ReadOnlyConnectionPool(self._open_main_reader, 2)
+        self.write_lock = threading.RLock()
+        self._writer = None
+    
+    def _open_writer(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=self.STATEMENT_CACHE)
+        for pragma in self.WRITER_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def _open_main_reader(self):
+        conn = sqlite3.connect(_readonly_uri(self.db_path), uri=True, check_same_thread=False,
+                               cached_statements=self.STATEMENT_CACHE)
+        for pragma in self.READER_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def acquire_writer(self, timeout: float = -1):
+        """获取写锁并返回写连接，用完后必须调用release_writer()
+        
+        timeout为正数时最多等待这么多秒，超时抛出TimeoutError（供主线程使用，避免界面卡死）
+        """
+        if not self.write_lock.acquire(timeout=timeout):
+            raise TimeoutError("数据库正忙，请等待当前写入操作完成后重试")
+        try:
+            if self._writer is None:
+                self._writer = self._open_writer()
+        except Exception:
+            self.write_lock.release()
+            raise
+        return self._writer
+    
+    def release_writer(self, rollback: bool = False):
+        """释放写锁，rollback为True时先回滚未提交的修改"""
+        try:
+            if rollback and self._writer is not None and self._writer.in_transaction:
+                self._writer.rollback()
+        finally:
+            self.write_lock.release()
+    
+    @contextmanager
+    def write(self, timeout: float = -1):
+        """在写锁内使用写连接，发生异常时回滚（提交由调用方决定）"""
+        conn = self.acquire_writer(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.release_writer(rollback=True)
+            raise
+        self.release_writer()
+    
+    @contextmanager
+    def read(self):
+        """从连接池借用一个只读连接"""
+        item = self.readers.acquire()
+        try:
+            yield item[1]
+        finally:
+            self.readers.release(item)
+    
+    @contextmanager
+    def read_main(self):
+        """借用一个只打开主数据库的只读连接"""
+        item = self.main_readers.acquire()
+        try:
+            yield item[1]
+        finally:
+            self.main_readers.release(item)
+    
+    def warm_up(self, writer: bool = True):
+        """预先打开写连接和一个只读连接（同时确保数据库处于WAL模式）
+        
+        writer为False时只打开只读连接，用于写连接已建立、不能等待写锁的场合
+        """
+        if writer:
+            with self.write():
+                pass
+        with self.read():
+            pass
+    
+    def close_all(self):
+        """关闭全部连接，数据库文件被替换前调用"""
+        with self.write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        self.readers.reset()
+        self.main_readers.reset()
+
+
+class _ServerMetrics:
+    """查询服务的请求统计"""
+    
+    def __init__(self, window: int = 10000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.lookups = 0
+        self.latencies = deque(maxlen=window)  # 最近请求的延迟（毫秒）
+    
+    def record(self, elapsed_ms: float, lookups: int, error: bool):
+        with self.lock:
+            self.requests += 1
+            self.lookups += lookups
+            self.errors += error
+            self.latencies.append(elapsed_ms)
+    
+    def snapshot(self) -> dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            uptime = time.time() - self.started
+            requests, errors, lookups = self.requests, self.errors, self.lookups
+        
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+        
+        return {
+            'uptime_seconds': round(uptime, 1),
+            'requests': requests,
+            'errors': errors,
+            'lookups': lookups,
+            'lookups_per_second': round(lookups / uptime, 1) if uptime > 0 else 0.0,
+            'latency_ms': {
+                'p50': round(percentile(0.50), 3),
+                'p95': round(percentile(0.95), 3),
+                'p99': round(percentile(0.99), 3),
+                'max': round(latencies[-1], 3) if latencies else 0.0,
+            },
+        }
+
+
+class _ColorLookupHandler(BaseHTTPRequestHandler):
+    """HTTP请求处理：
+    
+    GET  /color/<hex>          精确查找
+    GET  /nearest/<hex>        最近颜色
+    GET  /search?q=..&limit=.. 名称搜索
+    POST /batch                批量查找 {"colors": [...], "mode": "exact"|"nearest"}
+    GET  /metrics              延迟与吞吐统计
+    """
+    
+    protocol_version = "HTTP/1.1"  # 保持连接，减少批量客户端的握手开销
+    wbufsize = -1  # 缓冲输出，响应头和响应体合并为一次发送
+    disable_nagle_algorithm = True  # TCP_NODELAY，避免保持连接时小响应被延迟确认拖慢约40毫秒
+    server_version = "ColorLookup/1.0"
+    
+    def log_message(self, format, *args):
+        pass  # 统计信息已由_ServerMetrics记录
+    
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _handle(self, method: str):
+        start_time = time.perf_counter()
+        service = self.server.service
+        lookups = 0
+        error = True
+        try:
+            status, payload, lookups = service.dispatch(method, self)
+            error = status >= 400 and status != 404  # 未找到颜色不算错误
+        except Exception as e:
+            status, payload = 500, {'error': str(e)}
+        self._send_json(status, payload)
+        service.metrics.record((time.perf_counter() - start_time) * 1000, lookups, error)
+    
+    def do_GET(self):
+        self._handle('GET')
+    
+    def do_POST(self):
+        self._handle('POST')
+
+
+class ColorLookupServer:
+    """基于标准库http.server的本地颜色查询服务，与GUI共用colors数据库"""
+    
+    MAX_BATCH = 10000  # 单次批量请求最多包含的颜色数量
+    MAX_BODY = 1 << 20  # 批量请求体的最大字节数
+    MAX_DRAIN = 16 << 20  # 超限的请求体不超过该大小时读取丢弃以保持连接，更大时直接关闭连接
+    
+    def __init__(self, engine, host: str = "127.0.0.1", port: int = 8765):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.metrics = _ServerMetrics()
+        self.httpd = None
+        self.thread = None
+    
+    def start(self, warm_up_writer: bool = True):
+        """在后台线程中启动服务"""
+        # 请求线程从引擎的连接池借用只读连接，写连接负责确保WAL模式
+        self.engine.connections.warm_up(writer=warm_up_writer)
+        self.httpd = ThreadingHTTPServer((self.host, self.port), _ColorLookupHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = self
+        self.port = self.httpd.server_address[1]
+        self.metrics = _ServerMetrics()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """停止服务并关闭连接"""
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+    
+    @property
+    def running(self) -> bool:
+        return self.httpd is not None
+    
+    @staticmethod
+    def _color_payload(rgb, found) -> dict:
+        r, g, b = rgb
+        payload = {'hex': f"#{r:02x}{g:02x}{b:02x}", 'r': r, 'g': g, 'b': b}
+        if found is None:
+            payload['error'] = "not found"
+        else:
+            payload.update(found)
+        return payload
+    
+    def _resolve(self, conn, rgb, mode: str, generation: int = None):
+        """查找单个颜色，返回用于响应的附加字段或None"""
+        if mode == 'nearest':
+            row = self.engine.nearest(conn, *rgb, generation)
+            if row is None:
+                return None
+            r, g, b, name, source, d2 = row
+            return {'name': name, 'source': source,
+                    'match': f"#{r:02x}{g:02x}{b:02x}", 'distance': round(d2 ** 0.5, 3)}
+        row = self.engine.lookup(conn, *rgb, generation)
+        if row is None:
+            return None
+        return {'name': row[0], 'source': row[1]}
+    
+    def dispatch(self, method: str, request) -> tuple:
+        """处理请求，返回 (状态码, 响应数据, 查找次数)"""
+        url = urlsplit(request.path)
+        parts = [unquote(p) for p in url.path.strip('/').split('/') if p]
+        
+        if method == 'GET' and parts == ['metrics']:
+            return 200, self.metrics.snapshot(), 0
+        if method == 'GET' and parts == ['health']:
+            return 200, {'status': 'ok'}, 0
+        
+        if method == 'GET' and len(parts) == 2 and parts[0] in ('color', 'nearest'):
+            rgb = parse_color(parts[1])
+            if rgb is None:
+                return 400, {'error': f"invalid color: {parts[1]}"}, 0
+            mode = 'nearest' if parts[0] == 'nearest' else 'exact'
+            with self.engine.connections.read() as conn:
+                found = self._resolve(conn, rgb, mode)
+            return (200 if found else 404), self._color_payload(rgb, found), 1
+        
+        if method == 'GET' and parts == ['search']:
+            query = parse_qs(url.query)
+            pattern = query.get('q', [''])[0]
+            if not pattern:
+                return 400, {'error': "missing parameter: q"}, 0
+            try:
+                limit = max(1, min(int(query.get('limit', ['50'])[0]), 1000))
+            except ValueError:
+                return 400, {'error': "invalid parameter: limit"}, 0
+            rows = self.engine.search(pattern, limit)
+            results = [
+                {'hex': f"#{r:02x}{g:02x}{b:02x}", 'r': r, 'g': g, 'b': b,
+                 'name': name, 'source': source}
+                for r, g, b, name, source in rows
+            ]
+            return 200, {'results': results}, 1
+        
+        if method == 'POST' and parts == ['batch']:
+            # 请求体未被读取时必须关闭连接，否则剩余内容会被当作下一个请求解析
+            length = request.headers.get('Content-Length')
+            if length is None or 'Transfer-Encoding' in request.headers:
+                request.close_connection = True
+                return 411, {'error': "Content-Length required"}, 0
+            if not length.strip().isdigit():
+                request.close_connection = True
+                return 400, {'error': f"invalid Content-Length: {length}"}, 0
+            length = int(length)
+            if length > self.MAX_BODY:
+                if length > self.MAX_DRAIN:
+                    request.close_connection = True
+                else:
+                    while length > 0:
+                        chunk = request.rfile.read(min(length, 1 << 16))
+                        if not chunk:
+                            break
+                        length -= len(chunk)
+                return 413, {'error': f"request body larger than {self.MAX_BODY} bytes"}, 0
+            try:
+                data = json.loads(request.rfile.read(length).decode('utf-8'))
+            except ValueError:
+                return 400, {'error': "invalid JSON body"}, 0
+            if isinstance(data, list):
+                data = {'colors': data}
+            colors = data.get('colors') if isinstance(data, dict) else None
+            mode = data.get('mode', 'exact') if isinstance(data, dict) else 'exact'
+            if not isinstance(colors, list) or mode not in ('exact', 'nearest'):
+                return 400, {'error': "expected {\"colors\": [...], \"mode\": \"exact\"|\"nearest\"}"}, 0
+            if len(colors) > self.MAX_BATCH:
+                return 413, {'error': f"at most {self.MAX_BATCH} colors per request"}, 0
+            
+            results = []
+            with self.engine.connections.read() as conn:
+                # 数据代数每批只读一次，缓存命中时不再为每个颜色查询meta表
+                generation = self.engine.read_generation(conn)
+                for text in colors:
+                    rgb = parse_color(str(text))
+                    if rgb is None:
+                        results.append({'input': text, 'error': "invalid color"})
+                        continue
+                    found = self._resolve(conn, rgb, mode, generation)
+                    results.append(self._color_payload(rgb, found))
+            return 200, {'results': results}, len(colors)
+        
+        return 404, {'error': "unknown endpoint"}, 0
+
 
 class ColorDatabaseBuilderGUI:
     """RGB颜色数据库构建工具 - 完整优化版（带全操作进度条）"""
     
+    GAP_FILL_SUFFIX = " (近似)"  # 补全生成的名称可选的派生后缀
+    WRITE_LOCK_TIMEOUT = 2.0  # 主线程等待写锁的最长秒数
+    
     def __init__(self, master, db_path: str = "ColorDatabase.db"):
         self.master = master
         self.db_path = db_path
         self.task_queue = Queue()
         self.current_operation = None
         self.batch_size_var = tk.IntVar(value=1000)  # 初始化batch_size_var
-        
-        # 修改顺序：先设置UI再初始化数据库
+        self.reject_budget_var = tk.IntVar(value=50)  # 导入时允许的最大拒绝率(%)
+        self.bitmap = None  # 颜色存在位图，在后台初始化时加载
+        self.bitmap_dirty = False  # 单条添加后位图只在内存中更新，批量任务结束或退出时再写入文件
+        self.bitmap_path = db_path + ".bitmap"
+        self.build_path = db_path + ".building"  # 替换/清空时先在旁路文件中构建
+        self.snapshot_path = db_path + ".snapshot"  # 上一次替换前的快照
+        self.query_engine = ColorQueryEngine(db_path, self.log_message)  # 查询与导出（可联合多个数据库）
+        self.lookup_server = None  # 可选的本地HTTP查询服务
+        self.server_port_var = tk.IntVar(value=8765)
+        self.cache_entries_var = tk.IntVar(value=10000)
+        self.cache_mb_var = tk.IntVar(value=64)
+        self.startup_time = time.perf_counter()  # 用于统计首帧耗时
+        self._first_frame_logged = False
+        
+        # 先显示窗口，数据库结构和统计信息在后台线程中加载
         self.setup_ui()  # 先创建UI元素
-        self._initialize_database()  # 然后初始化数据库
+        self.master.bind('<Map>', self._on_first_frame, add='+')
+        self.master.protocol("WM_DELETE_WINDOW", self.on_close)
         self.check_queue()
+        self._refresh_cache_stats()
+        self.update_operation_status("初始化数据库")  # 加载完成前阻止其他操作
+        self.enable_buttons(False)
+        threading.Thread(target=self._initialize_database, daemon=True).start()
     
     def setup_ui(self):
         """设置用户界面"""
@@ -73,6 +1943,42 @@ class ColorDatabaseBuilderGUI:
         )
         self.clear_btn.pack(fill=tk.X, pady=2)
         
+        self.coverage_btn = ttk.Button(
+            btn_frame, text="5. 覆盖率分析", 
+            command=lambda: self.start_thread(self.analyze_coverage)
+        )
+        self.coverage_btn.pack(fill=tk.X, pady=2)
+        
+        self.fill_btn = ttk.Button(
+            btn_frame, text="6. 补全未命名颜色", 
+            command=lambda: self.start_thread(self.fill_gaps)
+        )
+        self.fill_btn.pack(fill=tk.X, pady=2)
+        
+        self.restore_btn = ttk.Button(
+            btn_frame, text="7. 恢复快照", 
+            command=lambda: self.start_thread(self.restore_snapshot)
+        )
+        self.restore_btn.pack(fill=tk.X, pady=2)
+        
+        self.query_btn = ttk.Button(
+            btn_frame, text="8. 查询颜色", 
+            command=self.query_colors
+        )
+        self.query_btn.pack(fill=tk.X, pady=2)
+        
+        self.sources_btn = ttk.Button(
+            btn_frame, text="9. 数据源管理", 
+            command=self.manage_sources
+        )
+        self.sources_btn.pack(fill=tk.X, pady=2)
+        
+        self.server_btn = ttk.Button(
+            btn_frame, text="10. 启动查询服务", 
+            command=self.toggle_lookup_server
+        )
+        self.server_btn.pack(fill=tk.X, pady=2)
+        
         # 操作状态面板
         self.operation_panel = ttk.LabelFrame(left_panel, text="当前操作状态", padding=10)
         self.operation_panel.pack(fill=tk.X, pady=10)
@@ -94,6 +2000,32 @@ class ColorDatabaseBuilderGUI:
             textvariable=self.batch_size_var
         ).pack(fill=tk.X)
         
+        ttk.Label(perf_frame, text="导入错误预算 (拒绝率%, 100为不限制):").pack(anchor=tk.W)
+        ttk.Spinbox(
+            perf_frame, from_=0, to=100, increment=5,
+            textvariable=self.reject_budget_var
+        ).pack(fill=tk.X)
+        
+        ttk.Label(perf_frame, text="查询缓存条目上限 (0为关闭):").pack(anchor=tk.W)
+        ttk.Spinbox(
+            perf_frame, from_=0, to=1000000, increment=1000,
+            textvariable=self.cache_entries_var
+        ).pack(fill=tk.X)
+        
+        ttk.Label(perf_frame, text="查询缓存内存上限 (MB):").pack(anchor=tk.W)
+        ttk.Spinbox(
+            perf_frame, from_=1, to=4096, increment=16,
+            textvariable=self.cache_mb_var
+        ).pack(fill=tk.X)
+        self.cache_entries_var.trace_add('write', self._resize_cache)
+        self.cache_mb_var.trace_add('write', self._resize_cache)
+        
+        ttk.Label(perf_frame, text="查询服务端口:").pack(anchor=tk.W)
+        ttk.Spinbox(
+            perf_frame, from_=1024, to=65535, increment=1,
+            textvariable=self.server_port_var
+        ).pack(fill=tk.X)
+        
         # 数据库信息显示
         info_frame = ttk.LabelFrame(left_panel, text="数据库信息", padding=10)
         info_frame.pack(fill=tk.X, pady=10)
@@ -159,9 +2091,16 @@ class ColorDatabaseBuilderGUI:
         )
         self.perf_stats.pack(fill=tk.X)
         
+        # 查询缓存统计
+        self.cache_stats = ttk.Label(
+            right_panel,
+            text="",
+            relief=tk.SUNKEN
+        )
+        self.cache_stats.pack(fill=tk.X)
+        
         # 初始化样式
         self.setup_styles()
-        self.update_db_info()
     
     def setup_styles(self):
         """配置界面样式"""
@@ -231,7 +2170,9 @@ class ColorDatabaseBuilderGUI:
         state = tk.NORMAL if enable else tk.DISABLED
         self.task_queue.put(lambda: [
             btn.config(state=state) 
-            for btn in [self.import_btn, self.export_btn, self.clear_btn, self.add_btn]
+            for btn in [self.import_btn, self.export_btn, self.clear_btn, self.add_btn,
+                        self.coverage_btn, self.fill_btn, self.restore_btn,
+                        self.query_btn, self.sources_btn]
         ])
     
     def show_progress(self, show: bool = True):
@@ -241,6 +2182,30 @@ class ColorDatabaseBuilderGUI:
         else:
             self.progress.pack_forget()
     
+    def start_busy_progress(self):
+        """以不确定模式显示主进度条（用于无法预估进度的单条语句）"""
+        def _start():
+            self.progress.configure(mode='indeterminate')
+            self.progress.start()
+        self.task_queue.put(_start)
+    
+    def stop_busy_progress(self):
+        """停止不确定模式进度条并恢复为确定模式"""
+        def _stop():
+            self.progress.stop()
+            self.progress.configure(mode='determinate')
+            self.progress['value'] = 0
+        self.task_queue.put(_stop)
+    
+    def _on_first_frame(self, event):
+        """窗口首次映射时记录首帧耗时"""
+        if self._first_frame_logged or event.widget is not self.master:
+            return
+        self._first_frame_logged = True
+        elapsed = (time.perf_counter() - self.startup_time) * 1000
+        self.log_message(f"窗口首帧耗时: {elapsed:.1f}毫秒")
+        self.update_perf_stats(f"性能统计: 首帧耗时 {elapsed:.1f}毫秒")
+    
     def show_sub_progress(self, show: bool = True):
         """显示/隐藏子进度条"""
         if show:
@@ -249,76 +2214,266 @@ class ColorDatabaseBuilderGUI:
             self.sub_progress.pack_forget()
     
     def _initialize_database(self):
-        """初始化数据库"""
-        self.update_operation_status("初始化数据库")
+        """初始化数据库（在后台线程中执行，不阻塞窗口显示）"""
         self.log_message("正在初始化数据库...")
-        self.show_progress(True)  # 现在可以安全调用，因为progress已创建
-        self.progress.configure(mode='indeterminate')
-        self.progress.start()
+        self.task_queue.put(lambda: self.show_progress(True))
+        self.start_busy_progress()
+        start_time = time.perf_counter()
         
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 检查表是否存在
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='colors'")
-            if not cursor.fetchone():
-                # 表不存在，创建表
-                cursor.execute("""
-                    CREATE TABLE colors (
-                    r SMALLINT NOT NULL CHECK(r >= 0 AND r <= 255),
-                    g SMALLINT NOT NULL CHECK(g >= 0 AND g <= 255),
-                    b SMALLINT NOT NULL CHECK(b >= 0 AND b <= 255),
-                    name TEXT NOT NULL,
-                    PRIMARY KEY (r, g, b)
+            # 同时打开长期保持的写连接，后续操作不再重复建立连接
+            with self.query_engine.connections.write() as conn:
+                cursor = conn.cursor()
+                
+                # 检查表是否存在
+                cursor.execute(STATEMENTS['table_exists'])
+                if not cursor.fetchone():
+                    # 表不存在，创建表
+                    self._create_schema(cursor)
+                    conn.commit()
+                    self.log_message("数据库表创建成功")
+                else:
+                    self._create_meta_table(cursor)  # 旧版本创建的数据库补建meta表
+                    conn.commit()
+                    self.log_message("数据库表已存在")
+                
+                self._load_bitmap(conn)
+            if self.query_engine.federated:
+                self.log_message(
+                    f"已注册 {len(self.query_engine.order) - 1} 个附加数据库，"
+                    f"查询优先级: {' > '.join(self.query_engine.order)}"
                 )
-            """)
-                cursor.execute("CREATE INDEX idx_rgb ON colors(r, g, b)")
-                conn.commit()
-                self.log_message("数据库表创建成功")
-            else:
-                self.log_message("数据库表已存在")
-            
-            conn.close()
-            self.log_message("数据库初始化完成")
+            elapsed = (time.perf_counter() - start_time) * 1000
+            self.log_message(f"数据库初始化完成 (耗时: {elapsed:.1f}毫秒)")
         except Exception as e:
             self.log_message(f"数据库初始化失败: {str(e)}")
-            raise
+            self.task_queue.put(lambda: self.db_info_label.config(text="数据库初始化失败"))
         finally:
-            self.progress.stop()
-            self.progress.configure(mode='determinate')
-            self.show_progress(False)
+            self.stop_busy_progress()
+            self.task_queue.put(lambda: self.show_progress(False))
             self.update_operation_status(None)
+            self.enable_buttons(True)
             self.update_db_info()
     
+    def _create_schema(self, cursor):
+        """创建colors表及索引"""
+        cursor.execute("""
+            CREATE TABLE colors (
+            r SMALLINT NOT NULL CHECK(r >= 0 AND r <= 255),
+            g SMALLINT NOT NULL CHECK(g >= 0 AND g <= 255),
+            b SMALLINT NOT NULL CHECK(b >= 0 AND b <= 255),
+            name TEXT NOT NULL,
+            PRIMARY KEY (r, g, b)
+        )
+        """)
+        cursor.execute("CREATE INDEX idx_rgb ON colors(r, g, b)")
+        self._create_meta_table(cursor)
+    
+    def _create_meta_table(self, cursor):
+        """创建保存数据代数等元数据的meta表"""
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+    
+    def _remove_database_file(self, path: str):
+        """删除数据库文件及其遗留的日志文件"""
+        for suffix in ('', '-journal', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    
+    def _create_side_database(self):
+        """创建空的旁路数据库，返回其连接"""
+        with self.query_engine.connections.read_main() as live:
+            generation = ColorQueryEngine.read_generation(live)
+        
+        self._remove_database_file(self.build_path)
+        conn = sqlite3.connect(self.build_path)
+        self._create_schema(conn.cursor())
+        # 新文件的代数必须大于旧文件，换入后缓存才会失效
+        ColorQueryEngine.write_generation(conn, generation + 1)
+        conn.commit()
+        return conn
+    
+    def _take_snapshot(self):
+        """使用sqlite3 backup API将当前数据库复制为快照"""
+        tmp_path = self.snapshot_path + '.tmp'
+        self._remove_database_file(tmp_path)
+        
+        def on_progress(status, remaining, total):
+            self.progress['maximum'] = total
+            self.progress['value'] = total - remaining
+            self.update_status(f"保存快照: {total - remaining:,}/{total:,} 页")
+        
+        # 分步复制，每步之间释放锁，其他连接仍可读取
+        target = sqlite3.connect(tmp_path)
+        try:
+            with self.query_engine.connections.read_main() as source:
+                source.backup(target, pages=1024, progress=on_progress)
+            # 快照必须是完整的颜色数据库，否则不能替换上一次的快照
+            complete = target.execute(STATEMENTS['table_exists']).fetchone() is not None
+        finally:
+            target.close()
+        if not complete:
+            self._remove_database_file(tmp_path)
+            raise ValueError("快照不完整：缺少colors表，已取消操作")
+        os.replace(tmp_path, self.snapshot_path)
+        
+        # 位图文件与数据库文件一一对应
+        if os.path.exists(self.bitmap_path):
+            shutil.copyfile(self.bitmap_path, self.snapshot_path + '.bitmap')
+        elif os.path.exists(self.snapshot_path + '.bitmap'):
+            os.remove(self.snapshot_path + '.bitmap')
+    
+    def _release_database_handles(self):
+        """替换数据库文件前关闭长期持有的连接（Windows下打开的文件无法被替换）"""
+        self.query_engine.connections.close_all()
+    
+    def _on_database_replaced(self):
+        """数据库文件被替换后重新打开连接，新文件同时切换为WAL模式"""
+        self.query_engine.connections.warm_up()
+    
+    def _swap_in_database(self, side_path: str):
+        """保存快照后用旁路数据库原子地替换当前数据库"""
+        self._take_snapshot()
+        
+        # 确保WAL内容已写回主文件，再清理旧文件遗留的日志，避免被应用到新文件
+        with self.query_engine.connections.write() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._release_database_handles()
+        os.replace(side_path, self.db_path)
+        for suffix in ('-journal', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+        self._remove_database_file(side_path)
+        self._on_database_replaced()
+        
+        with self.query_engine.connections.write() as conn:
+            self._save_bitmap(conn.cursor())
+        self.log_message(f"新数据库已换入，原数据已保存为快照: {self.snapshot_path}")
+    
+    def _load_bitmap(self, conn, force: bool = False):
+        """加载持久化的存在位图，文件缺失或与数据库不一致时重建，force为True时总是重建"""
+        start_time = time.perf_counter()
+        self.bitmap_dirty = False
+        bitmap = None if force else ColorPresenceBitmap.load(self.bitmap_path)
+        max_rowid = conn.execute(STATEMENTS['max_rowid']).fetchone()[0] or 0
+        
+        if bitmap is not None and bitmap.max_rowid == max_rowid:
+            self.bitmap = bitmap
+            elapsed = (time.perf_counter() - start_time) * 1000
+            self.log_message(f"存在位图已加载: {len(bitmap):,} 种颜色 (耗时: {elapsed:.1f}毫秒)")
+            return
+        
+        self.log_message("存在位图缺失或已过期，正在从数据库重建...")
+        self.bitmap = ColorPresenceBitmap.from_database(conn, self.batch_size_var.get())
+        self.bitmap.save(self.bitmap_path)
+        elapsed = (time.perf_counter() - start_time) * 1000
+        self.log_message(f"存在位图重建完成: {len(self.bitmap):,} 种颜色 (耗时: {elapsed:.1f}毫秒)")
+    
+    def _save_bitmap(self, cursor):
+        """写入成功后持久化存在位图"""
+        if self.bitmap is None:
+            return
+        self.bitmap.max_rowid = cursor.execute(STATEMENTS['max_rowid']).fetchone()[0] or 0
+        self.bitmap.save(self.bitmap_path)
+        self.bitmap_dirty = False
+    
+    def _flush_bitmap(self, timeout: float = -1):
+        """写入单条添加后尚未保存的存在位图（文件过期时下次加载会自动重建，因此可以延后）"""
+        if self.bitmap is None or not self.bitmap_dirty:
+            return
+        with self.query_engine.connections.write(timeout) as conn:
+            self._save_bitmap(conn.cursor())
+    
+    def _rebuild_bitmap(self):
+        """存在位图与数据库不一致时作为一次独立操作重建
+        
+        重建期间持有写锁，其他写入操作不会同时读取或修改位图
+        """
+        self.enable_buttons(False)
+        self.update_operation_status("重建存在位图")
+        self.task_queue.put(lambda: self.show_progress(True))
+        self.start_busy_progress()
+        self.update_status("正在重建存在位图...")
+        try:
+            with self.query_engine.connections.write() as conn:
+                self._load_bitmap(conn, force=True)
+        except Exception as e:
+            self.log_message(f"重建存在位图错误: {str(e)}")
+        finally:
+            self.stop_busy_progress()
+            self.task_queue.put(lambda: self.show_progress(False))
+            self.update_status("就绪")
+            self.enable_buttons(True)
+            self.update_operation_status(None)
+    
+    def _reload_bitmap(self):
+        """写入失败后丢弃内存中的位图修改，重新加载已提交的状态"""
+        with self.query_engine.connections.read_main() as conn:
+            self._load_bitmap(conn)
+    
+    def _insert_batch(self, cursor, batch: list) -> int:
+        """批量写入颜色，先用存在位图过滤重复颜色，返回实际写入的数量"""
+        if self.bitmap is not None:
+            batch = self.bitmap.filter_new(batch)
+            if not batch:
+                return 0
+        cursor.executemany(STATEMENTS['insert_color'], batch)
+        return cursor.rowcount
+    
     def update_db_info(self):
-        """更新数据库信息显示"""
+        """更新数据库信息显示（统计在后台线程中进行）"""
+        threading.Thread(target=self._load_db_info, daemon=True).start()
+    
+    def _load_db_info(self):
+        """加载数据库统计信息：先显示基于rowid的快速估计，再显示精确计数"""
         try:
-            start_time = time.time()
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 确保表存在
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='colors'")
-            if not cursor.fetchone():
-                self.task_queue.put(lambda: self.db_info_label.config(text="数据库未初始化"))
-                return
-            
-            count = cursor.execute("SELECT COUNT(*) FROM colors").fetchone()[0]
-            last_color = cursor.execute(
-                "SELECT r, g, b, name FROM colors ORDER BY rowid DESC LIMIT 1"
-            ).fetchone()
-            conn.close()
+            start_time = time.perf_counter()
+            with self.query_engine.connections.read_main() as conn:
+                cursor = conn.cursor()
+                
+                # 确保表存在
+                cursor.execute(STATEMENTS['table_exists'])
+                if not cursor.fetchone():
+                    self.task_queue.put(lambda: self.db_info_label.config(text="数据库未初始化"))
+                    return
+                
+                # MAX(rowid)只需读取B树最右侧页面，大表上也能立即返回
+                last_color = cursor.execute(STATEMENTS['last_color']).fetchone()
+                estimate = cursor.execute(STATEMENTS['max_rowid']).fetchone()[0] or 0
+                self.task_queue.put(
+                    lambda: self._update_db_info(estimate, last_color, estimated=True)
+                )
+                
+                count = cursor.execute(STATEMENTS['count']).fetchone()[0]
+                
+                # 借助精确计数校验存在位图（其他程序修改过数据库时需要重建），
+                # 重建交给主线程作为一次操作启动，不在统计线程中替换位图
+                if (self.bitmap is not None and len(self.bitmap) != count
+                        and self.current_operation is None):
+                    self.log_message(
+                        f"存在位图 ({len(self.bitmap):,}) 与数据库 ({count:,}) 不一致"
+                    )
+                    self.task_queue.put(self._schedule_bitmap_rebuild)
             
-            query_time = (time.time() - start_time) * 1000  # 毫秒
+            query_time = (time.perf_counter() - start_time) * 1000  # 毫秒
             
             self.task_queue.put(lambda: self._update_db_info(count, last_color))
+            self.log_message(f"数据库统计完成 (耗时: {query_time:.1f}毫秒)")
         except Exception as e:
             self.log_message(f"更新数据库信息错误: {str(e)}")
     
-    def _update_db_info(self, count, last_color):
+    def _schedule_bitmap_rebuild(self):
+        """在主线程中启动位图重建；已有操作在进行时跳过，下次统计时会再次检查"""
+        if self.current_operation is None:
+            self.start_thread(self._rebuild_bitmap)
+    
+    def _update_db_info(self, count, last_color, estimated: bool = False):
         """实际更新数据库信息的方法"""
-        self.db_info_label.config(text=f"当前颜色数量: {count:,} 种")
+        if estimated:
+            self.db_info_label.config(text=f"当前颜色数量: 约 {count:,} 种 (统计中...)")
+        else:
+            self.db_info_label.config(text=f"当前颜色数量: {count:,} 种")
         
         if last_color:
             r, g, b, name = last_color
@@ -381,16 +2536,15 @@ class ColorDatabaseBuilderGUI:
             # 第一步：选择文件
             file_path = filedialog.askopenfilename(
                 title="选择颜色数据文件",
-                filetypes=[
-                    ("CSV文件", "*.csv"),
-                    ("JSON文件", "*.json"),
-                    ("所有文件", "*.*")
-                ]
+                filetypes=format_filetypes()
             )
             
             if not file_path:
                 return
             
+            fmt = detect_format(file_path)
+            self.log_message(f"识别文件格式: {fmt.label}")
+            
             # 第二步：选择导入模式
             mode = self.ask_import_mode()
             if mode is None:
@@ -402,12 +2556,7 @@ class ColorDatabaseBuilderGUI:
             self.progress['value'] = 0
             self.update_status("准备导入数据...")
             
-            if file_path.endswith('.csv'):
-                success, total = self.import_from_csv(file_path, mode == 'replace')
-            elif file_path.endswith('.json'):
-                success, total = self.import_from_json(file_path, mode == 'replace')
-            else:
-                raise ValueError("不支持的文件格式")
+            success, total = self.import_from_file(file_path, fmt, mode == 'replace')
             
             elapsed = time.time() - start_time
             speed = success / elapsed if elapsed > 0 else float('inf')
@@ -424,6 +2573,8 @@ class ColorDatabaseBuilderGUI:
             self.update_db_info()
             messagebox.showinfo("导入成功", "颜色数据导入完成！")
         except Exception as e:
+            self._remove_database_file(self.build_path)
+            self._reload_bitmap()
             messagebox.showerror("导入失败", f"错误: {str(e)}")
             self.log_message(f"导入错误: {str(e)}")
         finally:
@@ -433,167 +2584,246 @@ class ColorDatabaseBuilderGUI:
             self.update_operation_status(None)
             self.show_progress(False)
     
-    def import_from_csv(self, file_path: str, replace: bool = False) -> tuple:
-        """从CSV导入颜色数据"""
-        batch_size = self.batch_size_var.get()
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            rows = list(reader)
-        
-        if not rows:
-            raise ValueError("CSV文件为空")
-        
-        # 自动检测是否有标题行
-        has_header = any(cell.lower() in ('r', 'red', 'name') for cell in rows[0])
+    def _open_import_target(self, replace: bool):
+        """打开导入目标：替换模式下写入旁路数据库，导入期间当前数据保持可读"""
+        if not replace:
+            return self.query_engine.connections.acquire_writer()
+        
+        self.update_status("创建旁路数据库...")
+        if self.bitmap is not None:
+            self.bitmap.clear()
+        self.log_message(f"替换模式: 新数据将先写入 {self.build_path}")
+        return self._create_side_database()
+    
+    def _commit_import(self, conn, replace: bool):
+        """提交导入结果，替换模式下将构建好的旁路数据库换入"""
+        if not replace:
+            try:
+                ColorQueryEngine.write_generation(conn)
+                conn.commit()
+                self._save_bitmap(conn.cursor())
+            except Exception:
+                self._abort_import(conn, replace)
+                raise
+            self.query_engine.connections.release_writer()
+            return
         
-        total = len(rows) - (1 if has_header else 0)
-        if total == 0:
-            raise ValueError("没有可导入的数据行")
+        conn.commit()
+        conn.close()
+        self._swap_in_database(self.build_path)
+    
+    def _abort_import(self, conn, replace: bool):
+        """放弃导入：追加模式回滚并归还写连接，替换模式关闭旁路数据库"""
+        if replace:
+            conn.close()
+        else:
+            self.query_engine.connections.release_writer(rollback=True)
+    
+    def import_from_file(self, file_path: str, fmt: ColorFormat, replace: bool = False) -> tuple:
+        """流式导入颜色文件：格式插件分批读取，逐批去重写入，内存占用与文件大小无关"""
+        batch_size = self.batch_size_var.get()
+        size = max(os.path.getsize(file_path), 1)
         
-        self.progress['maximum'] = total
+        # 总行数事先未知，进度按已读取的字节数计算
+        self.progress['maximum'] = size
         self.progress['value'] = 0
-        self.update_status(f"正在导入 {total:,} 条颜色数据...")
+        self.update_status(f"正在导入{fmt.label}...")
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if replace:
-            self.update_status("清空现有数据库...")
-            cursor.execute("DELETE FROM colors")
-            self.log_message("已清空现有数据库")
+        # 无效记录写入旁路文件，不再逐条输出到日志
+        reject = RejectSink(
+            file_path + '.rejects.csv',
+            self.reject_budget_var.get() / 100, fmt.unit
+        )
         
         success = 0
-        batch = []
-        
-        for i, row in enumerate(rows):
-            if has_header and i == 0:
-                continue
-            
+        read = 0
+        with open(file_path, 'rb') as raw:
+            stream = raw if fmt.binary else io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+            conn = self._open_import_target(replace)
             try:
-                if len(row) >= 4:
-                    r, g, b = int(row[0]), int(row[1]), int(row[2])
-                    name = row[3].strip()
-                    
-                    if not all(0 <= x <= 255 for x in (r, g, b)):
-                        raise ValueError(f"无效的RGB值: {r},{g},{b}")
-                    
-                    batch.append((r, g, b, name))
-                    
-                    # 批量提交
-                    if len(batch) >= batch_size:
-                        cursor.executemany(
-                            "INSERT OR IGNORE INTO colors VALUES (?, ?, ?, ?)",
-                            batch
-                        )
-                        success += len(batch)
-                        batch = []
+                cursor = conn.cursor()
+                for batch in fmt.read(stream, batch_size, reject):
+                    success += self._insert_batch(cursor, batch)
+                    read += len(batch)
                     
                     # 更新进度
-                    processed = i + 1 - (1 if has_header else 0)
-                    if processed % 100 == 0 or processed == total:
-                        self.progress['value'] = processed
-                        self.update_status(
-                            f"处理中: {processed:,}/{total:,} "
-                            f"({processed/total*100:.1f}%)"
-                        )
-            
-            except (ValueError, IndexError) as e:
-                self.log_message(f"跳过第 {i+1} 行: {str(e)}")
-        
-        # 提交剩余批次
-        if batch:
-            cursor.executemany(
-                "INSERT OR IGNORE INTO colors VALUES (?, ?, ?, ?)",
-                batch
-            )
-            success += len(batch)
+                    position = raw.tell()
+                    self.progress['value'] = position
+                    self.update_status(
+                        f"处理中: {read:,} 条 ({position/size*100:.1f}%)"
+                    )
+                
+                if read + reject.count == 0:
+                    raise ValueError("没有可导入的数据行")
+            except Exception:
+                self._abort_import(conn, replace)
+                raise
+            finally:
+                reject.close()
         
-        conn.commit()
-        conn.close()
+        self._commit_import(conn, replace)
+        if reject.count:
+            self.log_message(reject.summary())
         
-        self.progress['value'] = total
-        return success, total
+        self.progress['value'] = size
+        return success, read + reject.count
     
-    def import_from_json(self, file_path: str, replace: bool = False) -> tuple:
-        """从JSON导入颜色数据"""
-        batch_size = self.batch_size_var.get()
+    EXPORT_ORDER_LABELS = [
+        ("存储顺序", None),
+        ("按RGB", 'rgb'),
+        ("按名称", 'name'),
+        ("按插入顺序", 'insert'),
+    ]
+    
+    def ask_export_filter(self):
+        """询问导出范围，返回筛选条件spec（全部导出时为空字典），取消时返回None"""
+        dialog = tk.Toplevel(self.master)
+        dialog.title("导出范围")
+        dialog.resizable(False, False)
+        dialog.transient(self.master)
+        dialog.grab_set()
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        form = ttk.Frame(dialog, padding=10)
+        form.pack(fill=tk.BOTH)
+        ttk.Label(form, text="留空表示不限制").grid(row=0, column=0, columnspan=4, sticky=tk.W, pady=(0, 5))
+        
+        range_vars = {}
+        for row, (key, label) in enumerate(
+            [('r', "R 范围:"), ('g', "G 范围:"), ('b', "B 范围:"), ('rowid', "插入序号:")], start=1
+        ):
+            lo, hi = tk.StringVar(), tk.StringVar()
+            range_vars[key] = (lo, hi)
+            ttk.Label(form, text=label).grid(row=row, column=0, sticky=tk.W, pady=2)
+            ttk.Entry(form, textvariable=lo, width=10).grid(row=row, column=1, padx=2)
+            ttk.Label(form, text="至").grid(row=row, column=2)
+            ttk.Entry(form, textvariable=hi, width=10).grid(row=row, column=3, padx=2)
+        
+        name_var = tk.StringVar()
+        ttk.Label(form, text="名称模式:").grid(row=5, column=0, sticky=tk.W, pady=2)
+        ttk.Entry(form, textvariable=name_var, width=25).grid(row=5, column=1, columnspan=3, sticky=tk.W + tk.E)
+        ttk.Label(form, text="支持 * 和 ? 通配符，区分大小写", foreground='gray').grid(
+            row=6, column=1, columnspan=3, sticky=tk.W
+        )
         
-        if not isinstance(data, list):
-            raise ValueError("JSON文件应该包含颜色数组")
+        order_var = tk.StringVar(value=self.EXPORT_ORDER_LABELS[0][0])
+        ttk.Label(form, text="排序:").grid(row=7, column=0, sticky=tk.W, pady=2)
+        ttk.Combobox(
+            form, textvariable=order_var, state='readonly', width=12,
+            values=[label for label, _ in self.EXPORT_ORDER_LABELS]
+        ).grid(row=7, column=1, columnspan=3, sticky=tk.W)
+        
+        # 已保存的查询
+        queries = self.query_engine.queries
+        saved_var = tk.StringVar()
+        saved_frame = ttk.LabelFrame(dialog, text="已保存的查询", padding=10)
+        saved_frame.pack(fill=tk.X, padx=10)
+        saved_box = ttk.Combobox(saved_frame, textvariable=saved_var, width=20, values=sorted(queries))
+        saved_box.pack(side=tk.LEFT)
+        
+        def read_spec():
+            spec = {}
+            for key, (lo, hi) in range_vars.items():
+                lo_text, hi_text = lo.get().strip(), hi.get().strip()
+                if not lo_text and not hi_text:
+                    continue
+                limit = 255 if key != 'rowid' else (1 << 63) - 1
+                bounds = (int(lo_text) if lo_text else 0, int(hi_text) if hi_text else limit)
+                if not 0 <= bounds[0] <= bounds[1] <= limit:
+                    raise ValueError(f"无效的范围: {bounds[0]} 至 {bounds[1]}")
+                spec[key] = bounds
+            if name_var.get().strip():
+                spec['name'] = name_var.get().strip()
+            order = dict(self.EXPORT_ORDER_LABELS)[order_var.get()]
+            if order:
+                spec['order'] = order
+            return spec
+        
+        def fill_spec(spec):
+            for key, (lo, hi) in range_vars.items():
+                bounds = spec.get(key)
+                lo.set(str(bounds[0]) if bounds else "")
+                hi.set(str(bounds[1]) if bounds else "")
+            name_var.set(spec.get('name', ""))
+            labels = {order: label for label, order in self.EXPORT_ORDER_LABELS}
+            order_var.set(labels[spec.get('order')])
+        
+        def on_load():
+            if saved_var.get() in queries:
+                fill_spec(queries[saved_var.get()])
+        
+        def on_save():
+            name = saved_var.get().strip()
+            if not name:
+                messagebox.showwarning("警告", "请输入查询名称", parent=dialog)
+                return
+            try:
+                spec = read_spec()
+            except ValueError as e:
+                messagebox.showerror("错误", str(e), parent=dialog)
+                return
+            self.query_engine.save_query(name, spec)
+            saved_box['values'] = sorted(queries)
+            self.log_message(f"已保存导出查询: {name}")
         
-        total = len(data)
-        if total == 0:
-            raise ValueError("没有可导入的颜色数据")
+        ttk.Button(saved_frame, text="载入", command=on_load).pack(side=tk.LEFT, padx=5)
+        ttk.Button(saved_frame, text="保存", command=on_save).pack(side=tk.LEFT)
         
-        self.progress['maximum'] = total
-        self.progress['value'] = 0
-        self.update_status(f"正在导入 {total:,} 条颜色数据...")
+        result = []
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        def on_confirm():
+            try:
+                result.append(read_spec())
+            except ValueError as e:
+                messagebox.showerror("错误", str(e), parent=dialog)
+                return
+            dialog.destroy()
         
-        if replace:
-            self.update_status("清空现有数据库...")
-            cursor.execute("DELETE FROM colors")
-            self.log_message("已清空现有数据库")
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=10)
         
-        success = 0
-        batch = []
+        ttk.Button(btn_frame, text="确定", command=on_confirm).pack(side=tk.LEFT, padx=10)
+        ttk.Button(btn_frame, text="取消", command=dialog.destroy).pack(side=tk.LEFT)
         
-        for i, item in enumerate(data):
+        dialog.wait_window()
+        return result[0] if result else None
+    
+    def _prepare_export(self, spec: dict) -> int:
+        """准备导出：按需创建名称索引，记录查询计划并返回估计行数（只用于显示进度）"""
+        engine = self.query_engine
+        by_name = spec.get('order') == 'name' and not engine.federated
+        # 以通配符开头的模式无法使用索引，不为它花时间建索引
+        by_prefix = bool(spec.get('name')) and bool(engine.glob_prefix(spec['name']))
+        if (by_name or by_prefix) and not engine.has_name_index():
+            self.update_status("正在创建名称索引...")
+            self.start_busy_progress()
             try:
-                if isinstance(item, dict):
-                    r = item.get('r', item.get('red', 0))
-                    g = item.get('g', item.get('green', 0))
-                    b = item.get('b', item.get('blue', 0))
-                    name = item.get('name', '').strip()
-                else:
-                    raise ValueError("无效的颜色数据格式")
-                
-                r, g, b = int(r), int(g), int(b)
-                
-                if not all(0 <= x <= 255 for x in (r, g, b)):
-                    raise ValueError(f"无效的RGB值: {r},{g},{b}")
-                
-                batch.append((r, g, b, name))
-                
-                # 批量提交
-                if len(batch) >= batch_size:
-                    cursor.executemany(
-                        "INSERT OR IGNORE INTO colors VALUES (?, ?, ?, ?)",
-                        batch
-                    )
-                    success += len(batch)
-                    batch = []
-                
-                # 更新进度
-                if (i + 1) % 100 == 0 or (i + 1) == total:
-                    self.progress['value'] = i + 1
-                    self.update_status(
-                        f"处理中: {i+1:,}/{total:,} "
-                        f"({(i+1)/total*100:.1f}%)"
-                    )
-            
-            except (ValueError, KeyError) as e:
-                self.log_message(f"跳过第 {i+1} 项: {str(e)}")
-        
-        # 提交剩余批次
-        if batch:
-            cursor.executemany(
-                "INSERT OR IGNORE INTO colors VALUES (?, ?, ?, ?)",
-                batch
-            )
-            success += len(batch)
+                if engine.ensure_name_index():
+                    self.log_message("已创建名称索引，用于按名称筛选和排序")
+            finally:
+                self.stop_busy_progress()
         
-        conn.commit()
-        conn.close()
+        total, plans = self.query_engine.estimate_rows(spec, self.bitmap)
+        if spec:
+            for plan in plans:
+                self.log_message(f"查询计划: {plan}")
+        if self.query_engine.federated and spec.get('order') not in (None, 'rgb'):
+            self.log_message("联合导出需要多路归并，结果将按RGB排序")
         
-        self.progress['value'] = total
-        return success, total
+        self.progress['maximum'] = max(total, 1)
+        self.progress['value'] = 0
+        self.update_status(f"正在导出约 {total:,} 条颜色数据..." if total else "正在导出颜色数据...")
+        return total
+    
+    def _update_export_progress(self, count: int, total: int):
+        """更新导出进度，实际行数超过估计值时进度条停在末尾，只显示已导出数量"""
+        self.progress['value'] = min(count, total)
+        if count > total:
+            self.update_status(f"导出中: {count:,}")
+            return
+        self.update_status(
+            f"导出中: {count:,}/~{total:,} "
+            f"({min(count / total, 1) * 100:.1f}%)"
+        )
     
     def export_colors(self):
         """导出颜色数据"""
@@ -606,28 +2836,26 @@ class ColorDatabaseBuilderGUI:
             file_path = filedialog.asksaveasfilename(
                 title="保存颜色数据",
                 defaultextension=".csv",
-                filetypes=[
-                    ("CSV文件", "*.csv"),
-                    ("JSON文件", "*.json"),
-                    ("所有文件", "*.*")
-                ]
+                filetypes=format_filetypes()
             )
             
             if not file_path:
                 return
             
-            # 第二步：执行导出
+            fmt = format_for_path(file_path)
+            
+            # 第二步：选择导出范围
+            spec = self.ask_export_filter()
+            if spec is None:
+                return
+            
+            # 第三步：执行导出
             start_time = time.time()
             self.log_message(f"开始导出到: {file_path}")
             self.progress['value'] = 0
             self.update_status("准备导出数据...")
             
-            if file_path.endswith('.csv'):
-                count = self.export_to_csv(file_path)
-            elif file_path.endswith('.json'):
-                count = self.export_to_json(file_path)
-            else:
-                raise ValueError("不支持的导出格式")
+            count = self.export_to_file(file_path, fmt, spec)
             
             elapsed = time.time() - start_time
             speed = count / elapsed if elapsed > 0 else float('inf')
@@ -652,112 +2880,26 @@ class ColorDatabaseBuilderGUI:
             self.update_operation_status(None)
             self.show_progress(False)
     
-    def export_to_csv(self, file_path: str) -> int:
-        """导出为CSV文件"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 先获取总数
-        cursor.execute("SELECT COUNT(*) FROM colors")
-        total = cursor.fetchone()[0]
-        
-        if total == 0:
-            raise ValueError("数据库中没有颜色数据")
-        
-        self.progress['maximum'] = total
-        self.progress['value'] = 0
-        self.update_status(f"正在导出 {total:,} 条颜色数据...")
-        
-        # 使用迭代器分批获取数据
-        cursor.execute("SELECT r, g, b, name FROM colors")
-        
-        with open(file_path, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['R', 'G', 'B', '颜色名称'])
-            
-            batch_size = self.batch_size_var.get()
-            count = 0
-            
-            while True:
-                batch = cursor.fetchmany(batch_size)
-                if not batch:
-                    break
-                
-                writer.writerows(batch)
-                count += len(batch)
-                
-                # 更新进度
-                if count % 100 == 0 or count == total:
-                    self.progress['value'] = count
-                    self.update_status(
-                        f"导出中: {count:,}/{total:,} "
-                        f"({count/total*100:.1f}%)"
-                    )
-        
-        conn.close()
-        return count
-    
-    def export_to_json(self, file_path: str) -> int:
-        """导出为JSON文件"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # 先获取总数
-        cursor.execute("SELECT COUNT(*) FROM colors")
-        total = cursor.fetchone()[0]
-        
-        if total == 0:
-            raise ValueError("数据库中没有颜色数据")
-        
-        self.progress['maximum'] = total
-        self.progress['value'] = 0
-        self.update_status(f"正在导出 {total:,} 条颜色数据...")
-        
-        # 使用迭代器分批获取数据
-        cursor.execute("SELECT r, g, b, name FROM colors")
+    def export_to_file(self, file_path: str, fmt: ColorFormat, spec: dict = None) -> int:
+        """流式导出：查询结果分批交给格式插件写出，spec为筛选条件（见ColorQueryEngine.filter_sql）"""
+        spec = spec or {}
+        # 估算行数驱动进度（联合查询时为各数据源之和），不做额外的COUNT(*)扫描
+        total = self._prepare_export(spec)
+        batch_size = self.batch_size_var.get()
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write('[\n')
-            
-            batch_size = self.batch_size_var.get()
+        def batches():
             count = 0
-            first_item = True
-            
-            while True:
-                batch = cursor.fetchmany(batch_size)
-                if not batch:
-                    break
-                
-                for row in batch:
-                    r, g, b, name = row
-                    color_data = {
-                        "r": r,
-                        "g": g,
-                        "b": b,
-                        "name": name
-                    }
-                    
-                    if not first_item:
-                        f.write(',\n')
-                    else:
-                        first_item = False
-                    
-                    json.dump(color_data, f, ensure_ascii=False)
-                
+            for batch in self.query_engine.iter_colors(batch_size, spec):
+                yield batch
                 count += len(batch)
-                
-                # 更新进度
-                if count % 100 == 0 or count == total:
-                    self.progress['value'] = count
-                    self.update_status(
-                        f"导出中: {count:,}/{total:,} "
-                        f"({count/total*100:.1f}%)"
-                    )
-            
-            f.write('\n]')
+                self._update_export_progress(count, total)
         
-        conn.close()
-        return count
+        if fmt.binary:
+            f = open(file_path, 'wb')
+        else:
+            f = open(file_path, 'w', encoding='utf-8', newline='')
+        with f:
+            return fmt.write(f, batches())
     
     def add_color(self):
         """添加单个颜色"""
@@ -812,6 +2954,9 @@ class ColorDatabaseBuilderGUI:
         btn_frame.grid(row=3, column=0, columnspan=2, pady=10)
         
         def confirm():
+            if self.current_operation is not None:
+                messagebox.showwarning("警告", f"正在执行: {self.current_operation}，请等待完成后再添加颜色")
+                return
             try:
                 name = name_entry.get().strip()
                 if not name:
@@ -832,24 +2977,25 @@ class ColorDatabaseBuilderGUI:
                 self.update_status("正在添加颜色...")
                 self.master.update_idletasks()
                 
-                # 模拟进度动画
-                for i in range(1, 101):
-                    time.sleep(0.01)  # 短暂延迟让进度条可见
-                    self.progress['value'] = i
-                    self.master.update_idletasks()
-                
                 # 实际添加操作
-                with sqlite3.connect(self.db_path) as conn:
-                    conn.execute(
-                        "INSERT OR REPLACE INTO colors VALUES (?, ?, ?, ?)",
-                        (r, g, b, name)
-                    )
+                start_time = time.perf_counter()
+                # 在主线程上只做有限等待，写锁被后台写入占用时提示重试而不是卡住界面
+                with self.query_engine.connections.write(timeout=self.WRITE_LOCK_TIMEOUT) as conn:
+                    with conn:
+                        conn.execute(STATEMENTS['replace_color'], (r, g, b, name))
+                        ColorQueryEngine.write_generation(conn)
+                    if self.bitmap is not None:
+                        self.bitmap.add(r, g, b)
+                        self.bitmap_dirty = True
+                self.progress['value'] = 100
+                elapsed = (time.perf_counter() - start_time) * 1000
+                self.update_perf_stats(f"性能统计: 添加颜色耗时 {elapsed:.1f}毫秒")
                 
                 self.log_message(f"添加颜色: {name} (R:{r}, G:{g}, B:{b})")
                 self.update_db_info()
                 messagebox.showinfo("成功", "颜色添加成功！")
                 dialog.destroy()
-            except ValueError as e:
+            except (ValueError, TimeoutError) as e:
                 messagebox.showerror("错误", str(e))
             finally:
                 self.enable_buttons(True)
@@ -873,32 +3019,28 @@ class ColorDatabaseBuilderGUI:
         try:
             if not messagebox.askyesno(
                 "确认清空", 
-                "确定要清空所有颜色数据吗？此操作不可恢复！",
+                "确定要清空所有颜色数据吗？当前数据将保存为快照，可通过\"恢复快照\"找回。",
                 icon='warning'
             ):
                 return
             
             start_time = time.time()
             self.log_message("开始清空数据库...")
-            self.progress['value'] = 0
-            self.update_status("准备清空数据库...")
-            
-            # 模拟进度更新
-            for i in range(1, 101):
-                time.sleep(0.02)  # 短暂延迟让进度条可见
-                self.progress['value'] = i
-                self.update_status(f"清空中... {i}%")
-                self.master.update_idletasks()
+            self.update_status("清空中...")
             
-            # 实际清空操作
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("DELETE FROM colors")
+            # 换入一个只有表结构的空数据库，无需逐行删除
+            self._create_side_database().close()
+            if self.bitmap is not None:
+                self.bitmap.clear()
+            self._swap_in_database(self.build_path)
             
             elapsed = time.time() - start_time
             self.log_message(f"数据库已清空 (耗时: {elapsed:.2f}秒)")
             self.update_db_info()
             messagebox.showinfo("成功", "数据库已清空")
         except Exception as e:
+            self._remove_database_file(self.build_path)
+            self._reload_bitmap()
             messagebox.showerror("错误", f"清空失败: {str(e)}")
             self.log_message(f"清空错误: {str(e)}")
         finally:
@@ -907,9 +3049,535 @@ class ColorDatabaseBuilderGUI:
             self.update_status("就绪")
             self.update_operation_status(None)
             self.show_progress(False)
+    
+    def restore_snapshot(self):
+        """与快照交换：快照成为当前数据库，当前数据库成为新的快照"""
+        if not os.path.exists(self.snapshot_path):
+            messagebox.showwarning("提示", "没有可恢复的快照")
+            return
+        if not messagebox.askyesno(
+            "确认恢复", 
+            "确定要恢复到上一次替换/清空前的数据吗？当前数据将保存为快照。"
+        ):
+            return
+        
+        self.enable_buttons(False)
+        self.update_operation_status("恢复快照")
+        
+        try:
+            start_time = time.time()
+            
+            with self.query_engine.connections.write() as conn:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                generation = ColorQueryEngine.read_generation(conn)
+            self._release_database_handles()
+            
+            # 三次重命名完成交换，数据库与位图文件一起交换；
+            # 记录已完成的重命名，中途失败时逆序撤销，保持原来的文件不变
+            renamed = []
+            try:
+                for current, snapshot in ((self.db_path, self.snapshot_path),
+                                          (self.bitmap_path, self.snapshot_path + '.bitmap')):
+                    tmp_path = current + '.swap'
+                    for src, dst in ((current, tmp_path), (snapshot, current), (tmp_path, snapshot)):
+                        if os.path.exists(src):
+                            os.replace(src, dst)
+                            renamed.append((src, dst))
+            except OSError:
+                for src, dst in reversed(renamed):
+                    os.replace(dst, src)
+                self._on_database_replaced()
+                raise
+            for suffix in ('-journal', '-wal', '-shm'):
+                if os.path.exists(self.db_path + suffix):
+                    os.remove(self.db_path + suffix)
+            self._on_database_replaced()
+            
+            # 恢复的文件代数可能更小，需要推进到新值以使缓存失效
+            with self.query_engine.connections.write() as conn:
+                with conn:
+                    self._create_meta_table(conn.cursor())
+                    ColorQueryEngine.write_generation(
+                        conn, max(generation, ColorQueryEngine.read_generation(conn)) + 1
+                    )
+            
+            self._reload_bitmap()
+            elapsed = time.time() - start_time
+            self.log_message(f"快照已恢复 (耗时: {elapsed:.2f}秒)")
+            self.update_db_info()
+            messagebox.showinfo("成功", "快照已恢复")
+        except Exception as e:
+            messagebox.showerror("错误", f"恢复失败: {str(e)}")
+            self.log_message(f"恢复错误: {str(e)}")
+        finally:
+            self.enable_buttons(True)
+            self.update_status("就绪")
+            self.update_operation_status(None)
+    
+    def analyze_coverage(self):
+        """基于存在位图分析RGB立方体的覆盖率"""
+        if self.bitmap is None:
+            messagebox.showwarning("提示", "存在位图尚未加载完成，请稍后再试")
+            return
+        
+        self.enable_buttons(False)
+        self.update_operation_status("覆盖率分析")
+        self.update_status("正在分析覆盖率...")
+        
+        try:
+            start_time = time.time()
+            report = self.bitmap.coverage_report()
+            elapsed = time.time() - start_time
+            
+            self.log_message(
+                f"覆盖率: 已命名 {report['named']:,}/{ColorPresenceBitmap.SIZE:,} 种颜色 "
+                f"({report['percent']:.4f}%)"
+            )
+            self.log_message(
+                f"空白区域: {report['empty_blocks']:,}/{report['total_blocks']:,} 个 "
+                f"{ColorPresenceBitmap.BLOCK}x{ColorPresenceBitmap.BLOCK}x{ColorPresenceBitmap.BLOCK} 分块"
+            )
+            hue_step = 360 // ColorPresenceBitmap.HUE_BINS
+            self.log_message("色相密度: " + ", ".join(
+                f"{i * hue_step}°:{d * 100:.2f}%"
+                for i, d in enumerate(report['hue_density']) if d is not None
+            ))
+            self.log_message("亮度密度: " + ", ".join(
+                f"L{i}:{d * 100:.2f}%"
+                for i, d in enumerate(report['lightness_density']) if d is not None
+            ))
+            self.update_perf_stats(f"性能统计: 覆盖率分析耗时 {elapsed * 1000:.1f}毫秒")
+            self.task_queue.put(lambda: self.show_coverage_heatmap(report))
+        except Exception as e:
+            messagebox.showerror("错误", f"覆盖率分析失败: {str(e)}")
+            self.log_message(f"覆盖率分析错误: {str(e)}")
+        finally:
+            self.enable_buttons(True)
+            self.update_status("就绪")
+            self.update_operation_status(None)
+    
+    def fill_gaps(self):
+        """为立方体中所有未命名的颜色批量生成名称（取最近的已命名颜色）"""
+        if self.bitmap is None:
+            messagebox.showwarning("提示", "存在位图尚未加载完成，请稍后再试")
+            return
+        if not len(self.bitmap):
+            messagebox.showwarning("提示", "数据库中没有已命名的颜色")
+            return
+        missing = ColorPresenceBitmap.SIZE - len(self.bitmap)
+        if missing == 0:
+            messagebox.showinfo("提示", "所有颜色都已命名")
+            return
+        
+        choice = messagebox.askyesnocancel(
+            "补全未命名颜色",
+            f"将为 {missing:,} 种未命名颜色生成名称。\n\n"
+            f"是否在生成的名称后添加\"{self.GAP_FILL_SUFFIX.strip()}\"后缀？"
+        )
+        if choice is None:
+            return
+        suffix = self.GAP_FILL_SUFFIX if choice else ""
+        
+        self.enable_buttons(False)
+        self.update_operation_status("补全颜色")
+        self.show_progress(True)
+        
+        try:
+            start_time = time.time()
+            self.log_message(f"开始补全 {missing:,} 种未命名颜色...")
+            self.update_status("正在加载已命名颜色...")
+            batch_size = self.batch_size_var.get()
+            
+            with self.query_engine.connections.write() as conn:
+                cursor = conn.cursor()
+                
+                # 只有真正命名的颜色才能作为种子：跳过之前补全（包括中途中断的补全）
+                # 生成的行，它们登记在meta的rowid区间中；旧版本生成的行按名称后缀识别
+                ranges = cursor.execute(STATEMENTS['gap_fill_ranges']).fetchall()
+                where = " AND ".join("rowid NOT BETWEEN ? AND ?" for _ in ranges)
+                cursor.execute(
+                    STATEMENTS['all_colors'] + (f" WHERE {where}" if where else ""),
+                    [bound for lo_hi in ranges for bound in lo_hi]
+                )
+                
+                # 按16x16x16分块对已命名颜色分桶，名称去重后以编号传给工作进程
+                labels = []
+                name_ids = {}
+                buckets = [[] for _ in range(_GAP_GRID ** 3)]
+                seeds = 0
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for r, g, b, name in rows:
+                        if name.endswith(self.GAP_FILL_SUFFIX):
+                            continue
+                        seeds += 1
+                        nid = name_ids.get(name)
+                        if nid is None:
+                            nid = name_ids[name] = len(labels)
+                            labels.append(name + suffix)
+                        buckets[_gap_block_index(r >> 4, g >> 4, b >> 4)].append((r, g, b, nid))
+                if not seeds:
+                    raise ValueError("数据库中只有补全生成的颜色，没有可作为依据的已命名颜色")
+                self.log_message(f"使用 {seeds:,} 种已命名颜色作为种子")
+                nearest_ring = _gap_nearest_rings(buckets)
+                
+                # 本次生成的行从当前最大rowid之后开始，每个分组提交时更新登记的区间
+                first_rowid = (cursor.execute(STATEMENTS['max_rowid']).fetchone()[0] or 0) + 1
+                
+                # 每个任务处理16个r平面，已全部命名的分块层直接跳过
+                bits = bytes(self.bitmap.bits)
+                slab_bytes = _GAP_BLOCK << 13
+                tasks = [
+                    (x, bits[x * slab_bytes:(x + 1) * slab_bytes])
+                    for x in range(_GAP_GRID)
+                    if bits[x * slab_bytes:(x + 1) * slab_bytes].count(0xFF) != slab_bytes
+                ]
+                
+                self.progress['maximum'] = missing
+                self.progress['value'] = 0
+                self.update_status(f"正在生成 {missing:,} 种颜色的名称...")
+                
+                success = 0
+                with ProcessPoolExecutor(
+                    initializer=_gap_worker_init, initargs=(buckets, nearest_ring)
+                ) as executor:
+                    for slab_r0, out in executor.map(_gap_fill_slab, tasks):
+                        batch = []
+                        for idx, nid in enumerate(out):
+                            if nid < 0:
+                                continue
+                            batch.append(
+                                (slab_r0 + (idx >> 16), (idx >> 8) & 255, idx & 255, labels[nid])
+                            )
+                            if len(batch) >= batch_size:
+                                success += self._insert_batch(cursor, batch)
+                                batch = []
+                        if batch:
+                            success += self._insert_batch(cursor, batch)
+                        last_rowid = cursor.execute(STATEMENTS['max_rowid']).fetchone()[0] or 0
+                        if last_rowid >= first_rowid:
+                            cursor.execute(STATEMENTS['write_gap_fill_range'], (first_rowid, last_rowid))
+                        ColorQueryEngine.write_generation(conn)
+                        conn.commit()
+                        
+                        self.progress['value'] = success
+                        self.update_status(
+                            f"补全中: {success:,}/{missing:,} "
+                            f"({success/missing*100:.1f}%)"
+                        )
+
+                self._save_bitmap(cursor)
+            
+            elapsed = time.time() - start_time
+            speed = success / elapsed if elapsed > 0 else float('inf')
+            self.log_message(
+                f"补全完成! 生成 {success:,} 条颜色名称 "
+                f"(耗时: {elapsed:.2f}秒, 速度: {speed:.1f}条/秒)"
+            )
+            self.update_perf_stats(
+                f"性能统计: 补全 {success:,} 条数据, 耗时 {elapsed:.2f}秒, "
+                f"速度 {speed:.1f}条/秒"
+            )
+            self.update_db_info()
+            messagebox.showinfo("补全成功", "未命名颜色已全部生成名称！")
+        except Exception as e:
+            self._reload_bitmap()
+            messagebox.showerror("补全失败", f"错误: {str(e)}")
+            self.log_message(f"补全错误: {str(e)}")
+        finally:
+            self.enable_buttons(True)
+            self.progress['value'] = 0
+            self.update_status("就绪")
+            self.update_operation_status(None)
+            self.show_progress(False)
+    
+    def query_colors(self):
+        """查询颜色：输入颜色值精确查找，输入其他文本按名称搜索"""
+        dialog = tk.Toplevel(self.master)
+        dialog.title("查询颜色")
+        dialog.transient(self.master)
+        
+        ttk.Label(dialog, text="颜色值 (#RRGGBB 或 R,G,B) 或名称关键字:").pack(
+            anchor=tk.W, padx=10, pady=(10, 0)
+        )
+        
+        input_frame = ttk.Frame(dialog)
+        input_frame.pack(fill=tk.X, padx=10, pady=5)
+        query_entry = ttk.Entry(input_frame, width=30)
+        query_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        tree = ttk.Treeview(
+            dialog, columns=('rgb', 'name', 'source'), show='headings', height=12
+        )
+        tree.heading('rgb', text="RGB")
+        tree.heading('name', text="颜色名称")
+        tree.heading('source', text="数据源")
+        tree.column('rgb', width=110)
+        tree.column('source', width=70)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        result_var = tk.StringVar()
+        ttk.Label(dialog, textvariable=result_var).pack(anchor=tk.W, padx=10, pady=(0, 10))
+        
+        def show_results(rows, elapsed):
+            tree.delete(*tree.get_children())
+            for r, g, b, name, source in rows:
+                tree.insert('', tk.END, values=(f"{r}, {g}, {b}", name, source))
+            result_var.set(f"找到 {len(rows):,} 条结果 (耗时: {elapsed:.1f}毫秒)")
+        
+        def run_query(event=None):
+            text = query_entry.get().strip()
+            if not text:
+                return
+            result_var.set("查询中...")
+            
+            def work():
+                try:
+                    start_time = time.perf_counter()
+                    rgb = parse_color(text)
+                    if rgb is not None:
+                        with self.query_engine.connections.read() as conn:
+                            found = self.query_engine.lookup(conn, *rgb)
+                        rows = [rgb + found] if found else []
+                    else:
+                        rows = self.query_engine.search(text)
+                    elapsed = (time.perf_counter() - start_time) * 1000
+                    self.task_queue.put(lambda: show_results(rows, elapsed))
+                except Exception as e:
+                    self.log_message(f"查询错误: {str(e)}")
+                    self.task_queue.put(lambda: result_var.set(f"查询失败: {str(e)}"))
+            
+            threading.Thread(target=work, daemon=True).start()
+        
+        ttk.Button(input_frame, text="查询", command=run_query).pack(side=tk.LEFT, padx=5)
+        query_entry.bind('<Return>', run_query)
+        query_entry.focus_set()
+    
+    def manage_sources(self):
+        """管理联合查询的数据源及其优先级"""
+        engine = self.query_engine
+        dialog = tk.Toplevel(self.master)
+        dialog.title("数据源管理")
+        dialog.transient(self.master)
+        dialog.grab_set()
+        
+        ttk.Label(
+            dialog, text="查询和导出会合并以下数据库，同一颜色以靠前的数据库中的名称为准:"
+        ).pack(anchor=tk.W, padx=10, pady=(10, 5))
+        
+        listbox = tk.Listbox(dialog, width=70, height=10)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        def refresh(selected=None):
+            listbox.delete(0, tk.END)
+            for i, alias in enumerate(engine.order):
+                listbox.insert(tk.END, f"{i + 1}. [{alias}] {engine.paths[alias]}")
+            if selected in engine.order:
+                listbox.selection_set(engine.order.index(selected))
+        
+        def selected_alias():
+            selection = listbox.curselection()
+            return engine.order[selection[0]] if selection else None
+        
+        def add():
+            path = filedialog.askopenfilename(
+                parent=dialog,
+                title="选择颜色数据库",
+                filetypes=[("SQLite数据库", "*.db"), ("所有文件", "*.*")]
+            )
+            if not path:
+                return
+            try:
+                alias = engine.add_source(path)
+            except ValueError as e:
+                messagebox.showerror("错误", str(e), parent=dialog)
+                return
+            self.log_message(f"已附加数据库 [{alias}]: {path}")
+            refresh(alias)
+        
+        def remove():
+            alias = selected_alias()
+            if alias is None:
+                return
+            try:
+                engine.remove_source(alias)
+            except ValueError as e:
+                messagebox.showerror("错误", str(e), parent=dialog)
+                return
+            self.log_message(f"已移除数据库 [{alias}]")
+            refresh()
+        
+        def move(delta):
+            alias = selected_alias()
+            if alias is not None:
+                engine.move_source(alias, delta)
+                refresh(alias)
+        
+        btn_frame = ttk.Frame(dialog)
+        btn_frame.pack(pady=10)
+        ttk.Button(btn_frame, text="添加...", command=add).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="移除", command=remove).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="上移", command=lambda: move(-1)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="下移", command=lambda: move(1)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="关闭", command=dialog.destroy).pack(side=tk.LEFT, padx=5)
+        
+        refresh()
+    
+    def _resize_cache(self, *args):
+        """性能选项中的缓存上限修改后立即生效"""
+        try:
+            max_entries = self.cache_entries_var.get()
+            max_bytes = self.cache_mb_var.get() << 20
+        except tk.TclError:  # 输入框内容暂时不是有效数字
+            return
+        self.query_engine.cache.resize(max_entries, max_bytes)
+    
+    def _refresh_cache_stats(self):
+        """定期在性能面板中显示查询缓存的命中情况"""
+        stats = self.query_engine.cache.stats()
+        self.cache_stats.config(
+            text=f"查询缓存: {stats['entries']:,} 条 ({stats['bytes'] / 1048576:.1f}MB), "
+                 f"命中 {stats['hits']:,} / 未命中 {stats['misses']:,} "
+                 f"(命中率 {stats['hit_rate'] * 100:.1f}%), "
+                 f"淘汰 {stats['evictions']:,}, 失效 {stats['invalidations']:,}"
+        )
+        self.master.after(1000, self._refresh_cache_stats)
+    
+    def on_close(self):
+        """关闭窗口：保存尚未写入的存在位图并停止查询服务"""
+        try:
+            self._flush_bitmap(timeout=self.WRITE_LOCK_TIMEOUT)
+        except (TimeoutError, sqlite3.Error, OSError):
+            pass  # 位图文件已过期，下次启动时会从数据库重建
+        if self.lookup_server is not None and self.lookup_server.running:
+            self.lookup_server.stop()
+        self.master.destroy()
+    
+    def toggle_lookup_server(self):
+        """启动或停止本地HTTP查询服务"""
+        if self.lookup_server is not None and self.lookup_server.running:
+            self.lookup_server.stop()
+            self.log_message("查询服务已停止")
+            self.server_btn.config(text="10. 启动查询服务")
+            return
+        
+        try:
+            self.lookup_server = ColorLookupServer(
+                self.query_engine, port=self.server_port_var.get()
+            )
+            # 界面启动时已切换为WAL模式，不在主线程上等待可能被导入长时间占用的写锁
+            self.lookup_server.start(warm_up_writer=False)
+        except (OSError, sqlite3.Error, tk.TclError) as e:
+            self.lookup_server = None
+            messagebox.showerror("错误", f"查询服务启动失败: {str(e)}")
+            return
+        
+        self.log_message(
+            f"查询服务已启动: http://{self.lookup_server.host}:{self.lookup_server.port}/ "
+            f"(GET /color/<hex>, /nearest/<hex>, /search?q=, /metrics; POST /batch)"
+        )
+        self.server_btn.config(text="10. 停止查询服务")
+        self._refresh_server_stats()
+    
+    def _refresh_server_stats(self):
+        """定期在性能统计中显示查询服务的吞吐和延迟"""
+        if self.lookup_server is None or not self.lookup_server.running:
+            return
+        stats = self.lookup_server.metrics.snapshot()
+        if stats['requests']:
+            latency = stats['latency_ms']
+            self.perf_stats.config(
+                text=f"查询服务: {stats['requests']:,} 次请求, {stats['lookups']:,} 次查找 "
+                     f"({stats['lookups_per_second']:.1f}次/秒), 延迟 p50 {latency['p50']:.2f}毫秒 "
+                     f"p95 {latency['p95']:.2f}毫秒 p99 {latency['p99']:.2f}毫秒"
+            )
+        self.master.after(2000, self._refresh_server_stats)
+    
+    def show_coverage_heatmap(self, report: dict):
+        """显示色相 x 亮度的覆盖率热力图"""
+        dialog = tk.Toplevel(self.master)
+        dialog.title("颜色覆盖率热力图")
+        dialog.resizable(False, False)
+        dialog.transient(self.master)
+        
+        ttk.Label(
+            dialog,
+            text=f"已命名 {report['named']:,} 种颜色 ({report['percent']:.4f}%)，"
+                 f"空白分块 {report['empty_blocks']:,}/{report['total_blocks']:,}"
+        ).pack(padx=10, pady=5)
+        
+        cell_w, cell_h = 50, 36
+        hue_bins = ColorPresenceBitmap.HUE_BINS
+        light_bins = ColorPresenceBitmap.LIGHTNESS_BINS
+        canvas = tk.Canvas(
+            dialog, width=cell_w * hue_bins + 40, height=cell_h * light_bins + 20,
+            bg='white'
+        )
+        canvas.pack(padx=10, pady=5)
+        
+        for li, row in enumerate(report['grid_density']):
+            y = (light_bins - 1 - li) * cell_h  # 亮色在上方
+            canvas.create_text(20, y + cell_h / 2, text=f"L{li}")
+            for hi, density in enumerate(row):
+                x = 40 + hi * cell_w
+                if density is None:
+                    canvas.create_rectangle(x, y, x + cell_w, y + cell_h,
+                                            fill='', outline='#dddddd')
+                    continue
+                # 以该切片的代表色表示，密度越低越接近白色
+                r, g, b = colorsys.hls_to_rgb(
+                    (hi + 0.5) / hue_bins, (li + 0.5) / light_bins, 1.0
+                )
+                r, g, b = (int(255 - (255 - c * 255) * density) for c in (r, g, b))
+                canvas.create_rectangle(x, y, x + cell_w, y + cell_h,
+                                        fill=f'#{r:02x}{g:02x}{b:02x}', outline='#dddddd')
+                canvas.create_text(
+                    x + cell_w / 2, y + cell_h / 2, text=f"{density * 100:.1f}%",
+                    fill='white' if (r*0.299 + g*0.587 + b*0.114) < 150 else 'black'
+                )
+        
+        hue_step = 360 // hue_bins
+        for hi in range(hue_bins):
+            canvas.create_text(40 + hi * cell_w + cell_w / 2, cell_h * light_bins + 10,
+                               text=f"{hi * hue_step}°")
+        
+        ttk.Button(dialog, text="关闭", command=dialog.destroy).pack(pady=5)
 
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = ColorDatabaseBuilderGUI(root)
-    root.mainloop()
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="颜色数据库管理工具")
+    parser.add_argument("--db", default="ColorDatabase.db", help="数据库文件路径")
+    parser.add_argument("--serve", action="store_true", help="不启动界面，只运行HTTP查询服务")
+    parser.add_argument("--host", default="127.0.0.1", help="查询服务监听地址")
+    parser.add_argument("--port", type=int, default=8765, help="查询服务端口")
+    args = parser.parse_args()
+    
+    if args.serve:
+        # 服务只读访问数据库，文件或colors表不存在时直接退出，而不是对每个请求返回500
+        if not os.path.isfile(args.db):
+            parser.error(f"数据库文件不存在: {args.db}")
+        try:
+            conn = sqlite3.connect(_readonly_uri(args.db), uri=True)
+            try:
+                has_colors = conn.execute(STATEMENTS['table_exists']).fetchone() is not None
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            parser.error(f"无法打开数据库 {args.db}: {e}")
+        if not has_colors:
+            parser.error(f"数据库中没有colors表: {args.db}")
+        server = ColorLookupServer(ColorQueryEngine(args.db), args.host, args.port)
+        server.start()
+        print(f"查询服务已启动: http://{server.host}:{server.port}/ (Ctrl+C 停止)")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        root = tk.Tk()
+        app = ColorDatabaseBuilderGUI(root, args.db)
+        root.mainloop()
\ No newline at end of file